@@ -0,0 +1,155 @@
+"""
+Benchmark building and rendering the test tree for a deep generated suite.
+
+Compares resolving each item's full parent chain (``listchain()``) against
+the incremental ``TreeBuilder`` which only walks the part of each chain
+that differs from the previous item's, along with the equivalent rendering
+paths of ``TestTree._tlines``.
+
+Usage:
+
+    python bench/tree_build.py --depth 8 --classes 6 --modules 50
+"""
+import os
+import sys
+import math
+import shutil
+import argparse
+import tempfile
+from timeit import default_timer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+from interactive.plugin import TestTree, TreeBuilder, gen_nodes  # noqa
+
+
+def module_source(nclasses, ntests):
+    '''Return the source of a test module with test classes nested
+    ``nclasses`` deep each holding a plain test and the innermost holding
+    ``ntests`` parametrized tests
+    '''
+    lines = ['import pytest', '']
+    for level in range(nclasses):
+        indent = '    ' * level
+        lines += [indent + 'class TestLevel{}(object):'.format(level),
+                  indent + '    def test_plain(self):',
+                  indent + '        pass']
+    indent = '    ' * nclasses
+    lines += [indent + "@pytest.mark.parametrize('value', range({}))".format(
+                  ntests),
+              indent + 'def test_param({}value):'.format(
+                  'self, ' if nclasses else ''),
+              indent + '    pass', '']
+    return '\n'.join(lines)
+
+
+def make_suite(root, depth, nmodules, nclasses, ntests):
+    '''Write a suite of ``nmodules`` test modules to each of two leaf
+    packages nested ``depth`` packages deep below ``root``
+    '''
+    source = module_source(nclasses, ntests)
+    for leaf in ('a', 'b'):
+        pkgdir = root
+        for level in range(depth):
+            pkgdir = os.path.join(pkgdir, 'pkg{}{}'.format(leaf, level))
+            os.mkdir(pkgdir)
+            open(os.path.join(pkgdir, '__init__.py'), 'w').close()
+        for i in range(nmodules):
+            with open(os.path.join(pkgdir, 'test_m{}.py'.format(i)),
+                      'w') as f:
+                f.write(source)
+
+
+class Collector(object):
+    '''Keep the collected items and deselect them all
+    '''
+    items = None
+
+    def pytest_collection_modifyitems(self, items):
+        self.items = list(items)
+        items[:] = []
+
+
+def best(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = default_timer()
+        func()
+        timings.append(default_timer() - start)
+    return min(timings)
+
+
+def listchain_build(items):
+    cache = {}
+    for item in items:
+        list(gen_nodes(item, cache))
+
+
+def incremental_build(items):
+    builder = TreeBuilder({})
+    for item in items:
+        builder.gen(item)
+
+
+def listchain_tlines(items):
+    '''The rendering loop walking each item's full chain. Classes nested
+    more than one deep are printed again for each item since the stack of
+    printed collectors never matches a chain holding instance nodes.
+    '''
+    lines = []
+    stack = []
+    ncols = int(math.ceil(math.log10(len(items))))
+    for i, item in enumerate(items):
+        needed_collectors = item.listchain()[1:]
+        while stack:
+            if stack == needed_collectors[:len(stack)]:
+                break
+            stack.pop()
+        for col in needed_collectors[len(stack):]:
+            if col.name == "()":
+                continue
+            stack.append(col)
+            indent = (len(stack) - 1) * "  "
+            index = "{}".format(i) if col == item else ''
+            indent = indent[:-len(index) or None] + (ncols+1) * " "
+            lines.append((index, "{}{}".format(indent, col)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--modules', type=int, default=50)
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--tests', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='tree_build-')
+    try:
+        make_suite(root, args.depth, args.modules, args.classes, args.tests)
+        collector = Collector()
+        pytest.main(['-q', '-p', 'no:cacheprovider', root],
+                    plugins=[collector])
+        items = collector.items
+        tree = TestTree(items, None)
+        if args.classes <= 1:
+            assert tree._tlines(items) == listchain_tlines(items)
+        print("{} items, {} tree nodes, {} packages and {} classes deep"
+              .format(len(items), len(tree._nodes), args.depth,
+                      args.classes))
+        for name, old, new in (
+                ('build', listchain_build, incremental_build),
+                ('render', listchain_tlines, tree._tlines)):
+            told = best(lambda: old(items), args.repeat)
+            tnew = best(lambda: new(items), args.repeat)
+            print("{:<8} listchain {:>8.4f}s  incremental {:>8.4f}s"
+                  "  ({:.1f}x)".format(name, told, tnew, told / tnew))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
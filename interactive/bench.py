@@ -0,0 +1,54 @@
+"""
+Repeat run micro-benchmarking of single tests
+"""
+import json
+import math
+import statistics
+
+
+def summarize(timings):
+    '''Return a dict of summary statistics for a list of run times
+    '''
+    timings = sorted(timings)
+    p95 = timings[max(int(math.ceil(0.95 * len(timings))) - 1, 0)]
+    return {
+        'n': len(timings),
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'p95': p95,
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.,
+    }
+
+
+class Baselines(object):
+    '''Benchmark summaries stored by nodeid
+    '''
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.summaries = json.load(f)
+        except (IOError, ValueError):
+            self.summaries = {}
+
+    def get(self, nodeid):
+        return self.summaries.get(nodeid)
+
+    def set(self, nodeid, summary):
+        self.summaries[nodeid] = summary
+        with open(self.path, 'w') as f:
+            json.dump(self.summaries, f, separators=(',', ':'))
+
+
+def write_summary(tr, nodeid, summary, baseline=None):
+    '''Write a benchmark summary (compared against a baseline if provided)
+    to the terminal
+    '''
+    tr.write_line("{} ({} runs)".format(nodeid, summary['n']), bold=True)
+    for key in ('min', 'median', 'p95', 'stddev'):
+        tr.write("  {:<7}{:>12.6f}s".format(key, summary[key]))
+        if baseline and baseline.get(key) and key != 'stddev':
+            change = (summary[key] - baseline[key]) / baseline[key] * 100
+            tr.write("  {:>+8.1f}% vs baseline".format(change),
+                     red=change > 0, green=change <= 0)
+        tr.write_line("")
@@ -0,0 +1,92 @@
+"""
+Saving and restoring the selection and test set bindings of a shell session
+"""
+import os
+import json
+
+
+def dump_set(test_set):
+    '''Return a json serializable description of a test set
+    '''
+    state = {'path': list(test_set._path), 'params': list(test_set._params)}
+    if test_set._ind != slice(None):
+        # indexed sets are remapped by nodeid on restore
+        state['nodeids'] = [item.nodeid for item in test_set._items]
+    return state
+
+
+def dump(tree, ns):
+    '''Return the current selection of ``tree`` along with all bindings of
+    test sets in the namespace ``ns`` as a json serializable dict
+    '''
+    from .plugin import TestSet
+    return {
+        'selection': list(tree._selection.keys()),
+        'bindings': {name: dump_set(value) for name, value in ns.items()
+                     if isinstance(value, TestSet) and
+                     not name.startswith('_')},
+    }
+
+
+def save(path, tree, ns):
+    with open(path, 'w') as f:
+        json.dump(dump(tree, ns), f, separators=(',', ':'))
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _collect_files(tree, nodeids):
+    '''Collect any lazy modules containing tests in ``nodeids``
+    '''
+    from .plugin import _root_id
+    if not tree._lazy:
+        return
+    rootdir = str(tree._nodes[(_root_id,)].fspath)
+    files = set(os.path.normpath(os.path.join(rootdir, nodeid.split('::')[0]))
+                for nodeid in nodeids)
+    for modpath, fspath in list(tree._lazy.items()):
+        if os.path.normpath(fspath) in files:
+            tree._expand(modpath)
+
+
+def restore_set(tree, state):
+    '''Return a test set of ``tree`` as described by ``state`` or None if
+    its node no longer exists
+    '''
+    path = tuple(state['path'])
+    tree._expand(path, below=False)
+    if path not in tree._nodes:
+        return None
+    params = tuple(state['params'])
+    base = tree._root._new(path=path, indices=slice(None), params=params)
+    if 'nodeids' not in state:
+        return base
+    positions = {item.nodeid: i for i, item in enumerate(base._items)}
+    return base._new(indices=[positions[nodeid]
+                              for nodeid in state['nodeids']
+                              if nodeid in positions])
+
+
+def restore(tree, state):
+    '''Restore the selection described by ``state`` into ``tree`` remapping
+    tests by nodeid and return a map of names to restored test sets along
+    with the nodeids of selected tests which no longer exist
+    '''
+    nodeids = state.get('selection', [])
+    _collect_files(tree, nodeids)
+    items = tree._nodeid2item
+    missing = []
+    for nodeid in nodeids:
+        if nodeid in items:
+            tree._selection.append(items[nodeid])
+        else:
+            missing.append(nodeid)
+    bindings = {}
+    for name, setstate in state.get('bindings', {}).items():
+        test_set = restore_set(tree, setstate)
+        if test_set is not None:
+            bindings[name] = test_set
+    return bindings, missing
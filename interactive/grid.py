@@ -0,0 +1,122 @@
+"""
+An array backed matrix view over the parameters of parametrized tests
+"""
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return ('__repr__', repr(value))
+    return value
+
+
+class ParamGrid(object):
+    '''A matrix view of a test set where each parametrize argname is an axis.
+
+    Every test is stored as a row of integer codes (one column per axis,
+    -1 where a test doesn't use the argname) such that selecting a slab of
+    even a very large cartesian parametrization is a handful of vectorized
+    operations. Selections return a new test set and can be made per axis
+    by keyword:
+
+        grid(mode='a', size=slice(0, 10), inputs=['dog', 'cat'])
+
+    or positionally with the axes in order:
+
+        grid['a', :10]
+
+    A slice selects by position along an axis (in parametrize order), a
+    list, tuple or set selects any of its values and anything else selects
+    a single value.
+    '''
+    def __init__(self, test_set):
+        if np is None:
+            raise ImportError("the parameter grid requires numpy")
+        self._set = test_set
+        items = test_set._items
+        self.axes = OrderedDict()  # argname -> list of values
+        codes = OrderedDict()  # argname -> {value: code}
+        for item in items:
+            cs = getattr(item, 'callspec', None)
+            if not cs:
+                continue
+            # axes follow the order of the test function's arguments
+            order = {name: i for i, name in enumerate(item.fixturenames)}
+            params = sorted(cs.params.items(),
+                            key=lambda p: (order.get(p[0], len(order)), p[0]))
+            for argname, value in params:
+                valcodes = codes.setdefault(argname, {})
+                key = _hashable(value)
+                if key not in valcodes:
+                    valcodes[key] = len(valcodes)
+                    self.axes.setdefault(argname, []).append(value)
+        self._codes = codes
+        self._array = np.full((len(items), len(codes)), -1, dtype=np.int32)
+        for row, item in enumerate(items):
+            cs = getattr(item, 'callspec', None)
+            if not cs:
+                continue
+            for col, (argname, valcodes) in enumerate(codes.items()):
+                if argname in cs.params:
+                    self._array[row, col] = valcodes[
+                        _hashable(cs.params[argname])]
+        # map grid rows back to positions in the unindexed test set
+        self._positions = np.asarray(test_set._basepositions(), dtype=int)
+
+    @property
+    def shape(self):
+        return tuple(len(values) for values in self.axes.values())
+
+    def __repr__(self):
+        dims = ' x '.join('{}[{}]'.format(argname, len(values))
+                          for argname, values in self.axes.items())
+        return "<{} {} -> {} tests>".format(
+            type(self).__name__, dims or '()', len(self._array))
+
+    def __dir__(self):
+        return ['axes', 'shape'] + list(self.axes)
+
+    def _mask(self, argname, selector):
+        try:
+            col = list(self._codes).index(argname)
+        except ValueError:
+            raise KeyError("no parameter axis '{}'".format(argname))
+        column = self._array[:, col]
+        valcodes = self._codes[argname]
+        if isinstance(selector, slice):
+            codes = np.arange(len(valcodes))[selector]
+        elif isinstance(selector, (list, tuple, set, frozenset)):
+            codes = [valcodes[_hashable(v)] for v in selector
+                     if _hashable(v) in valcodes]
+        else:
+            return column == valcodes.get(_hashable(selector), -2)
+        return np.isin(column, codes)
+
+    def __call__(self, **selectors):
+        mask = np.ones(len(self._array), dtype=bool)
+        for argname, selector in selectors.items():
+            mask &= self._mask(argname, selector)
+        rows = np.flatnonzero(mask)
+        return self._set._new(indices=self._positions[rows].tolist())
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > len(self.axes):
+            raise IndexError("too many indices for a grid with {} axes"
+                             .format(len(self.axes)))
+        return self(**dict(zip(self.axes, key)))
+
+    def __getattr__(self, argname):
+        # tab-completable access to the values along each axis
+        try:
+            return object.__getattribute__(self, 'axes')[argname]
+        except KeyError:
+            raise AttributeError(argname)
@@ -0,0 +1,119 @@
+"""
+A shell history backend which batches writes to the history db
+"""
+import os
+import re
+import json
+import errno
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from IPython.core.history import HistoryManager
+
+
+def journaldir():
+    '''Return the local directory write-ahead journals are kept in
+    '''
+    return tempfile.gettempdir()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:  # py2 compat
+        return e.errno == errno.EPERM
+    return True
+
+
+class BatchedHistoryManager(HistoryManager):
+    '''A history manager which only writes inputs to the history db in
+    batches of ``batch_size`` from IPython's history saving thread such that
+    a slow (i.e. network mounted) db never stalls the prompt.
+
+    Each input is also appended to a small write-ahead journal in the local
+    temp dir until its batch has been written. Journals left behind by
+    crashed sessions are replayed into the db on startup.
+
+    A ``hist_file`` of ``':memory:'`` keeps history for the current session
+    only and writes nothing to disk.
+    '''
+    batch_size = 20
+
+    def __init__(self, shell=None, **traits):
+        traits.setdefault('db_cache_size', self.batch_size)
+        self._journal_lock = threading.Lock()
+        self.journal = None
+        super(BatchedHistoryManager, self).__init__(shell=shell, **traits)
+        if self.hist_file != ':memory:':
+            prefix = 'pytest_interactive-{}-'.format(hashlib.sha1(
+                str(self.hist_file).encode('utf-8')).hexdigest()[:12])
+            self._replay(prefix)
+            self.journal = os.path.join(journaldir(), '{}{}.journal'.format(
+                prefix, os.getpid()))
+
+    def _replay(self, prefix):
+        '''Write the inputs found in the journals of dead sessions to the db
+        and remove the journals
+        '''
+        pattern = re.compile(re.escape(prefix) + r'(\d+)\.journal$')
+        for fname in os.listdir(journaldir()):
+            match = pattern.match(fname)
+            if not match or _alive(int(match.group(1))):
+                continue
+            path = os.path.join(journaldir(), fname)
+            rows = []
+            with open(path) as f:
+                for line in f:
+                    try:
+                        rows.append(tuple(json.loads(line)))
+                    except ValueError:  # torn write at crash time
+                        break
+            try:
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO history VALUES (?, ?, ?, ?)",
+                        rows)
+            except sqlite3.Error:
+                self.log.error("Failed to replay history journal %s", path,
+                               exc_info=True)
+                continue
+            os.remove(path)
+
+    def store_inputs(self, line_num, source, source_raw=None):
+        nstored = len(self.input_hist_raw)
+        super(BatchedHistoryManager, self).store_inputs(
+            line_num, source, source_raw)
+        if not self.journal or len(self.input_hist_raw) == nstored:
+            return  # nothing was stored (i.e. an exit command)
+        with self._journal_lock:
+            with open(self.journal, 'a') as f:
+                f.write(json.dumps([
+                    self.session_number, line_num,
+                    self.input_hist_parsed[-1],
+                    self.input_hist_raw[-1]]) + '\n')
+
+    def writeout_cache(self, conn=None):
+        with self.db_input_cache_lock:
+            upto = self.db_input_cache[-1][0] if self.db_input_cache else None
+        super(BatchedHistoryManager, self).writeout_cache(conn)
+        if upto is not None and self.journal:
+            self._trim(upto)
+
+    def _trim(self, upto):
+        '''Drop all inputs up to line ``upto`` from the journal. Inputs
+        stored while a batch is being written may be written twice which is
+        harmless since replays never overwrite existing rows.
+        '''
+        with self._journal_lock:
+            try:
+                with open(self.journal) as f:
+                    lines = [line for line in f
+                             if json.loads(line)[1] > upto]
+            except IOError:
+                return
+            if lines:
+                with open(self.journal, 'w') as f:
+                    f.writelines(lines)
+            else:
+                os.remove(self.journal)
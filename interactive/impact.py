@@ -0,0 +1,228 @@
+"""
+Change impact analysis using per test line coverage and git diffs
+"""
+import os
+import re
+import sys
+import json
+import subprocess
+from bisect import bisect_left, bisect_right
+import pytest
+
+
+def intervals(lines):
+    '''Collapse an iterable of line numbers into a sorted list of inclusive
+    (start, end) intervals
+    '''
+    spans = []
+    for line in sorted(lines):
+        if spans and line == spans[-1][1] + 1:
+            spans[-1][1] = line
+        else:
+            spans.append([line, line])
+    return spans
+
+
+class CoverageMap(object):
+    '''Per test line coverage stored as an interval index per file.
+
+    Each file maps to a list of ``(start, end, testindex)`` entries sorted by
+    ``start``. Overlap queries bisect on the start lines and only scan back
+    as far as the longest interval in the file.
+    '''
+    def __init__(self, tests=(), files=None):
+        self.tests = list(tests)  # test index -> nodeid
+        self._ids = {nodeid: i for i, nodeid in enumerate(self.tests)}
+        self.files = files or {}
+        self._index = {}  # fspath -> (starts, maxspan)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cls()
+        return cls(data['tests'], data['files'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'tests': self.tests, 'files': self.files}, f,
+                      separators=(',', ':'))
+
+    def __contains__(self, nodeid):
+        return nodeid in self._ids
+
+    def update(self, records):
+        '''Replace the coverage of each test in ``records``, a map of nodeids
+        to maps of file paths to sets of executed lines
+        '''
+        if not records:
+            return
+        stale = set()
+        for nodeid in records:
+            if nodeid in self._ids:
+                stale.add(self._ids[nodeid])
+            else:
+                self._ids[nodeid] = len(self.tests)
+                self.tests.append(nodeid)
+        if stale:
+            for fspath, entries in self.files.items():
+                entries[:] = [e for e in entries if e[2] not in stale]
+        for nodeid, lines in records.items():
+            index = self._ids[nodeid]
+            for fspath, linenos in lines.items():
+                self.files.setdefault(fspath, []).extend(
+                    [start, end, index] for start, end in intervals(linenos))
+        for entries in self.files.values():
+            entries.sort()
+        self._index.clear()
+
+    def query(self, fspath, start, end):
+        '''Return the nodeids of all tests which executed any line in the
+        inclusive range ``start`` to ``end`` of ``fspath``
+        '''
+        entries = self.files.get(fspath)
+        if not entries:
+            return set()
+        try:
+            starts, maxspan = self._index[fspath]
+        except KeyError:
+            starts = [e[0] for e in entries]
+            maxspan = max(e[1] - e[0] for e in entries)
+            self._index[fspath] = starts, maxspan
+        lo = bisect_left(starts, start - maxspan)
+        hi = bisect_right(starts, end)
+        return set(self.tests[e[2]] for e in entries[lo:hi]
+                   if e[1] >= start)
+
+
+def mappath(config):
+    '''Return the path of the coverage map for the current rootdir
+    '''
+    from .plugin import rootpath
+    return rootpath(config, 'coverage')
+
+
+def load_map(config):
+    '''Return the coverage map being recorded in this session or the one
+    stored by a previous session
+    '''
+    recorder = config.pluginmanager.getplugin('interactive-coverage')
+    if recorder:
+        recorder.flush()
+        return recorder.covmap
+    return CoverageMap.load(mappath(config))
+
+
+class CoverageRecorder(object):
+    '''A pytest plugin recording the lines executed by each test in all
+    source files below ``rootdir`` using a trace function
+    '''
+    def __init__(self, rootdir, path):
+        self.path = path
+        self.covmap = CoverageMap.load(path)
+        self._root = os.path.join(os.path.realpath(str(rootdir)), '')
+        self._files = {}  # co_filename -> real path or None
+        self._lines = None
+        self._records = {}
+
+    def _trace(self, frame, event, arg):
+        filename = frame.f_code.co_filename
+        try:
+            fspath = self._files[filename]
+        except KeyError:
+            fspath = os.path.realpath(filename)
+            if not fspath.startswith(self._root):
+                fspath = None
+            self._files[filename] = fspath
+        if fspath is None:
+            return None
+        lines = self._lines.setdefault(fspath, set())
+        lines.add(frame.f_lineno)
+
+        def local(frame, event, arg):
+            if event == 'line':
+                lines.add(frame.f_lineno)
+            return local
+        return local
+
+    @pytest.mark.tryfirst
+    def pytest_runtest_protocol(self, item, nextitem):
+        self._lines = {}
+        sys.settrace(self._trace)
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == 'teardown' and self._lines is not None:
+            sys.settrace(None)
+            self._records[report.nodeid] = self._lines
+            self._lines = None
+
+    def stop(self):
+        '''Stop tracing a test which never finished (i.e. an interrupted
+        run) dropping its partial record
+        '''
+        if self._lines is not None:
+            sys.settrace(None)
+            self._lines = None
+
+    def flush(self):
+        '''Merge all recorded coverage into the map
+        '''
+        self.covmap.update(self._records)
+        self._records = {}
+
+    def pytest_unconfigure(self, config):
+        self.flush()
+        self.covmap.save(self.path)
+
+
+_hunk_re = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def changed_lines(rev, cwd=None):
+    '''Return a map of absolute file paths to lists of inclusive (start, end)
+    line ranges changed since the git revision ``rev``. Both the old and
+    new sides of each hunk are included since coverage may have been
+    recorded against either.
+    '''
+    toplevel = subprocess.check_output(
+        ['git', 'rev-parse', '--show-toplevel'], cwd=cwd
+    ).decode().strip()
+    diff = subprocess.check_output(
+        ['git', 'diff', '-U0', '--no-color', '--no-ext-diff', rev, '--'],
+        cwd=toplevel).decode('utf-8', 'replace')
+    changes = {}
+    old = new = None
+    for line in diff.splitlines():
+        if line.startswith('--- '):
+            old = line[6:] if line.startswith('--- a/') else None
+        elif line.startswith('+++ '):
+            new = line[6:] if line.startswith('+++ b/') else None
+        else:
+            match = _hunk_re.match(line)
+            if not match:
+                continue
+            ostart, olen, nstart, nlen = match.groups()
+            for fname, start, length in ((old, ostart, olen),
+                                         (new, nstart, nlen)):
+                if not fname:
+                    continue
+                start, length = int(start), int(length or 1)
+                fspath = os.path.realpath(os.path.join(toplevel, fname))
+                changes.setdefault(fspath, []).append(
+                    (start, start + max(length, 1) - 1))
+    return changes
+
+
+def affected(items, covmap, changes):
+    '''Return all ``items`` impacted by ``changes``. Tests which have no
+    recorded coverage are included if their own module changed.
+    '''
+    nodeids = set()
+    for fspath, ranges in changes.items():
+        for start, end in ranges:
+            nodeids |= covmap.query(fspath, start, end)
+    return [item for item in items if item.nodeid in nodeids or (
+            item.nodeid not in covmap and
+            os.path.realpath(str(item.fspath)) in changes)]
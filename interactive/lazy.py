@@ -0,0 +1,65 @@
+"""
+Lazy collection of test modules on first access from the shell
+"""
+import os
+from fnmatch import fnmatch
+
+
+def _matches(name, patterns):
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_modules(config, args=None):
+    '''Yield the path of each file found below the session's args (or
+    ``args``) which pytest would collect as a test module
+    '''
+    patterns = config.getini('python_files')
+    norecurse = config.getini('norecursedirs')
+    for arg in args or config.args:
+        fspath = os.path.abspath(str(arg).split('::')[0])
+        if os.path.isfile(fspath):
+            yield fspath
+            continue
+        for dirpath, dirnames, filenames in os.walk(fspath):
+            dirnames[:] = sorted(name for name in dirnames
+                                 if not _matches(name, norecurse))
+            for fname in sorted(filenames):
+                if fname.endswith('.py') and _matches(fname, patterns):
+                    yield os.path.join(dirpath, fname)
+
+
+def tree_paths(fspath, rootdir):
+    '''Return the tree paths of the packages containing the test module at
+    ``fspath`` followed by the module's own tree path, each paired with its
+    fs path. These match the paths :func:`interactive.plugin.gen_nodes`
+    generates once the module is collected.
+    '''
+    from .plugin import _root_id
+    pkgdirs = []
+    dirname = os.path.dirname(fspath)
+    while os.path.isfile(os.path.join(dirname, '__init__.py')):
+        pkgdirs.insert(0, dirname)
+        dirname = os.path.dirname(dirname)
+    path = (_root_id,)
+    entries = []
+    for pkgdir in pkgdirs:
+        if rootdir.startswith(os.path.join(pkgdir, '')):
+            continue
+        path += (os.path.basename(pkgdir),)
+        entries.append((path, pkgdir))
+    path += (os.path.splitext(os.path.basename(fspath))[0],)
+    entries.append((path, fspath))
+    return entries
+
+
+def collect(session, fspaths):
+    '''Collect the test modules at ``fspaths`` and return their items
+    '''
+    # older pytest versions memoize the session's collection result
+    for attr in ('_collected', '_ex__collected'):
+        session.__dict__.pop(attr, None)
+    session._ia_collecting = True
+    try:
+        return session.perform_collect(list(fspaths))
+    finally:
+        session._ia_collecting = False
@@ -0,0 +1,135 @@
+"""
+Last known test outcomes with incrementally maintained per node aggregates
+"""
+import json
+from bisect import bisect_left
+
+
+# when more than one phase of a test reports, the first of these wins
+_precedence = ('failed', 'error', 'skipped', 'passed')
+
+
+def report_outcome(report):
+    '''Return the outcome of a single test report phase
+    '''
+    if report.failed:
+        return 'failed' if report.when == 'call' else 'error'
+    elif report.skipped:
+        return 'skipped'
+    return 'passed'
+
+
+class Outcomes(object):
+    '''An index of the last known outcome and duration of each test in a
+    tree.
+
+    Per node outcome counts as well as the items of the virtual ``failed``
+    and ``slowest`` nodes are updated incrementally as results come in such
+    that none of them ever require a scan of the tree.
+
+    This object is also a pytest plugin which records the results of all
+    tests run during the session (including those run from the shell).
+    '''
+    def __init__(self, tree):
+        self._tree = tree
+        self.path = None
+        self.records = {}  # nodeid -> [outcome, duration]
+        self.counts = {}  # tree path -> {outcome: count}
+        self._slowkeys = []  # sorted keys for the 'slowest' items
+        self._pending = {}  # nodeid -> [outcome, duration] of running tests
+
+    def load(self, path):
+        '''Load the results stored at ``path`` by a previous session. Results
+        are saved back to the same path when the session ends.
+        '''
+        self.path = path
+        try:
+            with open(path) as f:
+                records = json.load(f)
+        except (IOError, ValueError):
+            records = {}
+        for nodeid, (outcome, duration) in records.items():
+            self.update(nodeid, outcome, duration)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.records, f, separators=(',', ':'))
+
+    def _view(self, name):
+        return self._tree._path2items[self._tree._root._path + (name,)]
+
+    def _slowkey(self, item):
+        return (-self.records[item.nodeid][1], item.nodeid)
+
+    def _count(self, item, delta):
+        outcome, duration = self.records[item.nodeid]
+        for path in self._tree._item2paths.get(item, ()):
+            counts = self.counts.setdefault(path, {})
+            counts[outcome] = counts.get(outcome, 0) + delta
+        if outcome in ('failed', 'error'):
+            failed = self._view('failed')
+            if delta > 0:
+                failed.append(item)
+            else:
+                failed.remove(item)
+        key = self._slowkey(item)
+        index = bisect_left(self._slowkeys, key)
+        if delta > 0:
+            self._slowkeys.insert(index, key)
+            self._view('slowest').insert(index, item)
+        else:
+            del self._slowkeys[index]
+            del self._view('slowest')[index]
+
+    def track(self, item):
+        '''Start tracking an item added to the tree
+        '''
+        if item.nodeid in self.records:
+            self._count(item, 1)
+
+    def discard(self, item):
+        '''Stop tracking an item being removed from the tree
+        '''
+        if item.nodeid in self.records:
+            self._count(item, -1)
+
+    def update(self, nodeid, outcome, duration):
+        '''Record a new result for a test
+        '''
+        item = self._tree._nodeid2item.get(nodeid)
+        if item is not None and nodeid in self.records:
+            self._count(item, -1)
+        self.records[nodeid] = [outcome, duration]
+        if item is not None:
+            self._count(item, 1)
+
+    def summary(self, items=None, path=None):
+        '''Return a map of outcomes to counts for all tests at ``path`` or
+        for the provided ``items``
+        '''
+        if path is not None:
+            return {outcome: count for outcome, count in
+                    self.counts.get(path, {}).items() if count}
+        counts = {}
+        for item in items:
+            record = self.records.get(item.nodeid)
+            if record:
+                counts[record[0]] = counts.get(record[0], 0) + 1
+        return counts
+
+    def pytest_runtest_logreport(self, report):
+        outcome, duration = self._pending.setdefault(
+            report.nodeid, ['passed', 0.])
+        current = report_outcome(report)
+        if _precedence.index(current) < _precedence.index(outcome):
+            outcome = current
+        duration += getattr(report, 'duration', 0.)
+        if report.when == 'teardown':
+            del self._pending[report.nodeid]
+            self.update(report.nodeid, outcome, duration)
+        else:
+            self._pending[report.nodeid] = [outcome, duration]
+
+    def pytest_unconfigure(self, config):
+        if self.path:
+            self.save(self.path)
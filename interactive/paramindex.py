@@ -0,0 +1,131 @@
+"""
+Typed indexes of the parameter values of parametrized tests
+"""
+from bisect import bisect_left, bisect_right
+from numbers import Real
+
+_ops = ('eq', 'ne', 'gt', 'ge', 'lt', 'le', 'in')
+
+
+def _kind(value):
+    '''Return the name of the sorted bucket ``value`` is indexed in or None
+    if it can't be ordered against other values
+    '''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, Real):
+        return 'number'
+    if isinstance(value, str):
+        return 'str'
+    return None
+
+
+def parse_condition(key):
+    '''Split a ``where`` keyword such as ``size__gt`` into its argname and
+    operator (``eq`` if none is given)
+    '''
+    argname, sep, op = key.rpartition('__')
+    if sep and op in _ops:
+        return argname, op
+    return key, 'eq'
+
+
+class ParamIndex(object):
+    '''An index of the callspec parameter values of a list of items by
+    argname.
+
+    Numbers and strings are kept in sorted arrays (per type) of values
+    along with the positions of their items such that equality and range
+    conditions are answered by bisection. Values of other types can only
+    be matched by equality and predicates which scan all values of their
+    argname.
+    '''
+    def __init__(self, items):
+        self._sorted = {}  # argname -> {kind: (values, positions)}
+        self._other = {}  # argname -> [(value, position), ...]
+        self._all = {}  # argname -> [(value, position), ...]
+        buckets = {}
+        for pos, item in enumerate(items):
+            cs = getattr(item, 'callspec', None)
+            if not cs:
+                continue
+            for argname, value in cs.params.items():
+                self._all.setdefault(argname, []).append((value, pos))
+                kind = _kind(value)
+                if kind:
+                    buckets.setdefault(argname, {}).setdefault(
+                        kind, []).append((value, pos))
+                else:
+                    self._other.setdefault(argname, []).append((value, pos))
+        for argname, kinds in buckets.items():
+            for kind, entries in kinds.items():
+                entries.sort()
+                self._sorted.setdefault(argname, {})[kind] = (
+                    [value for value, pos in entries],
+                    [pos for value, pos in entries])
+
+    @property
+    def argnames(self):
+        return sorted(self._all)
+
+    def _bucket(self, argname, value):
+        kind = _kind(value)
+        if kind is None:
+            return None
+        return self._sorted.get(argname, {}).get(kind, ([], []))
+
+    def _eq(self, argname, value):
+        bucket = self._bucket(argname, value)
+        if bucket is None:
+            return set(pos for other, pos in self._other.get(argname, ())
+                       if other == value)
+        values, positions = bucket
+        return set(positions[bisect_left(values, value):
+                             bisect_right(values, value)])
+
+    def _range(self, argname, op, value):
+        bucket = self._bucket(argname, value)
+        if bucket is None:
+            raise TypeError("'{}' can't be compared using '{}'".format(
+                value, op))
+        values, positions = bucket
+        if op == 'gt':
+            return set(positions[bisect_right(values, value):])
+        elif op == 'ge':
+            return set(positions[bisect_left(values, value):])
+        elif op == 'lt':
+            return set(positions[:bisect_left(values, value)])
+        return set(positions[:bisect_right(values, value)])  # le
+
+    def query(self, argname, op, value):
+        '''Return the set of positions of the items whose ``argname``
+        parameter satisfies ``op`` against ``value``. If ``value`` is
+        callable it is used as a predicate on the parameter instead.
+        '''
+        if argname not in self._all:
+            raise KeyError("no parameter '{}'".format(argname))
+        if callable(value):
+            return set(pos for param, pos in self._all[argname]
+                       if value(param))
+        if op == 'eq':
+            return self._eq(argname, value)
+        elif op == 'ne':
+            return (set(pos for param, pos in self._all[argname]) -
+                    self._eq(argname, value))
+        elif op == 'in':
+            positions = set()
+            for each in value:
+                positions |= self._eq(argname, each)
+            return positions
+        return self._range(argname, op, value)
+
+    def where(self, **conditions):
+        '''Return the sorted positions of the items satisfying all
+        ``conditions`` given as ``argname__op=value`` keywords
+        '''
+        positions = None
+        for key, value in conditions.items():
+            argname, op = parse_condition(key)
+            matches = self.query(argname, op, value)
+            positions = matches if positions is None else positions & matches
+        return sorted(positions or ())
@@ -4,9 +4,13 @@ import math
 import errno
 import re
 import os
+import sys
+import hashlib
+import threading
 from os.path import expanduser, join
 from operator import attrgetter, itemgetter
 from collections import OrderedDict, namedtuple
+from .outcomes import Outcomes
 
 
 def pytest_addoption(parser):
@@ -14,6 +18,113 @@ def pytest_addoption(parser):
                      dest='interactive',
                      help="enable iteractive selection of tests after"
                      " collection")
+    parser.addoption("--ia-reorder", action="store_true",
+                     dest='ia_reorder',
+                     help="reorder the final selection such that higher scoped"
+                     " parametrized fixtures are setup as few times as"
+                     " possible")
+    parser.addoption("--ia-warm", action="store", dest='ia_warm',
+                     choices=('session', 'module'), default=None,
+                     help="keep fixtures of this scope (and above) set up"
+                     " between in-shell runs started with %rerun")
+    parser.addoption("--ia-fork", action="store_true", dest='ia_fork',
+                     help="run tests started from the shell in a child"
+                     " process forked from the shell process")
+    parser.addoption("--ia-lazy", action="store_true", dest='ia_lazy',
+                     help="only walk the filesystem for test modules up front"
+                     " and collect each module on first access from the"
+                     " shell")
+    parser.addoption("--ia-history", action="store", dest='ia_history',
+                     metavar='PATH', default=None,
+                     help="shell history db to use (default is"
+                     " ~/.config/pytest_interactive/shell_history.sqlite);"
+                     " pass ':memory:' to keep no history on disk")
+    parser.addoption("--ia-resume", action="store", dest='ia_resume',
+                     metavar='FILE', default=None,
+                     help="restore the selection and test set bindings saved"
+                     " with %checkpoint")
+    parser.addoption("--ia-snapshot", action="store", dest='ia_snapshot',
+                     metavar='FILE', default=None,
+                     help="write a snapshot of the collected test tree to"
+                     " FILE for use with --ia-diff")
+    parser.addoption("--ia-diff", action="store", dest='ia_diff',
+                     metavar='OLD', default=None,
+                     help="report the tests added, removed or renamed since"
+                     " the snapshot OLD was taken instead of running any"
+                     " (exits with 1 on differences)")
+    parser.addoption("--ia-record-coverage", action="store_true",
+                     dest='ia_coverage',
+                     help="record the lines executed by each test for use"
+                     " in change impact selection with %affected")
+
+
+def pytest_configure(config):
+    if config.option.ia_coverage:
+        from .impact import CoverageRecorder, mappath
+        rootdir = getattr(config, 'rootdir', None) or os.getcwd()
+        config.pluginmanager.register(
+            CoverageRecorder(rootdir, mappath(config)),
+            'interactive-coverage')
+    if config.option.ia_snapshot or config.option.ia_diff:
+        if config.option.interactive and config.option.ia_lazy:
+            from _pytest.config import UsageError
+            raise UsageError("--ia-snapshot and --ia-diff require a full "
+                             "collection and can't be used with --ia-lazy")
+        from .snapshot import SnapshotDiff
+        config.pluginmanager.register(
+            SnapshotDiff(config.option.ia_snapshot, config.option.ia_diff),
+            'interactive-snapshot')
+
+
+def confpath(fname):
+    """Return the path to ``fname`` in the plugin's config directory
+    creating the directory if necessary
+    """
+    confdir = join(expanduser('~'), '.config', 'pytest_interactive')
+    try:
+        os.makedirs(confdir)
+    except OSError as e:  # py2 compat
+        if e.errno == errno.EEXIST:
+            pass
+        else:
+            raise
+    return join(confdir, fname)
+
+
+def rootpath(config, name):
+    """Return the path to the json file ``name`` in the plugin's config
+    directory which is specific to the current rootdir
+    """
+    rootdir = str(getattr(config, 'rootdir', None) or os.getcwd())
+    digest = hashlib.sha1(rootdir.encode('utf-8')).hexdigest()[:12]
+    return confpath('{}-{}.json'.format(name, digest))
+
+
+@pytest.mark.tryfirst
+def pytest_collection(session):
+    """in lazy mode build the top levels of the tree from a walk of the
+    filesystem and enter the shell without collecting anything. Modules
+    are collected on first access from the shell.
+    """
+    config = session.config
+    if not (config.option.interactive and config.option.ia_lazy):
+        return
+    from .lazy import walk_modules, tree_paths, collect
+
+    capman = config.pluginmanager.getplugin("capturemanager")
+    if capman:
+        capman.suspendcapture(in_=True)
+
+    tr = config.pluginmanager.getplugin('terminalreporter')
+    tr.write_line("walking test directories...")
+    tt = TestTree([], tr)
+    rootdir = _rootdir(config)
+    tt._add_lazy(session, [tree_paths(fspath, rootdir)
+                           for fspath in walk_modules(config)])
+    tt._collect = lambda fspaths: collect(session, fspaths)
+    session.items = launch_shell(session, config, tt)
+    session.testscollected = len(session.items)
+    return True
 
 
 @pytest.mark.trylast
@@ -23,8 +134,9 @@ def pytest_collection_modifyitems(session, config, items):
     """
     if not (config.option.interactive and items):
         return
-    else:
-        from .shell import PytestShellEmbed, SelectionMagics
+    if getattr(session, '_ia_collecting', False):
+        # collecting on demand from within the shell
+        return
 
     capman = config.pluginmanager.getplugin("capturemanager")
     if capman:
@@ -34,17 +146,26 @@ def pytest_collection_modifyitems(session, config, items):
     # build a tree of test items
     tr.write_line("building test tree...")
     tt = TestTree(items, tr)
+    items[:] = launch_shell(session, config, tt)
+
+
+def launch_shell(session, config, tt):
+    """Embed the selection shell for the test tree ``tt`` and return the
+    final selection of items to run once it exits
+    """
+    from .shell import PytestShellEmbed, SelectionMagics
+    from .runner import Runner
+    from .prefetch import Prefetcher
+
+    tr = tt._tr
+    tt._runner = Runner(session, tr, warm=config.option.ia_warm,
+                        fork=config.option.ia_fork, tree=tt)
+    # track results from the last and any upcoming runs
+    tt._outcomes.load(rootpath(config, 'outcomes'))
+    config.pluginmanager.register(tt._outcomes, 'interactive-outcomes')
     # prep ipython
-    fname = 'shell_history.sqlite'
-    confdir = join(expanduser('~'), '.config', 'pytest_interactive')
-    try:
-        os.makedirs(confdir)
-    except OSError as e:  # py2 compat
-        if e.errno == errno.EEXIST:
-            pass
-        else:
-            raise
-    PytestShellEmbed.pytest_hist_file = join(confdir, fname)
+    PytestShellEmbed.pytest_hist_file = (
+        config.option.ia_history or confpath('shell_history.sqlite'))
     ipshell = PytestShellEmbed(banner1='entering ipython workspace...',
                                exit_msg='exiting shell...')
     ipshell.register_magics(SelectionMagics)
@@ -52,6 +173,8 @@ def pytest_collection_modifyitems(session, config, items):
     tt._shell = ipshell
     # shell needs ref to curr selection
     ipshell.selection = tt._selection
+    # and the last known outcomes to estimate its run time
+    ipshell.outcomes = tt._outcomes
     # set the prompt to track number of selected test items
     pm = ipshell.prompt_manager
     bold_prmpt = '{color.number}' '{tt}' '{color.prompt}'
@@ -62,30 +185,65 @@ def pytest_collection_modifyitems(session, config, items):
 Please explore the test (collection) tree using tt.<TAB>
 When finished tabbing to a test node, simply call it to have
 pytest invoke all tests collected under that node."""
-    # embed
-    ipshell(msg, local_ns={
+    ns = {
         'tt': tt,
         'shell': ipshell,
         'config': config,
         'session': session,
-        })
+    }
+    if config.option.ia_resume:
+        from .checkpoint import load, restore
+        bindings, missing = restore(tt, load(config.option.ia_resume))
+        ns.update(bindings)
+        tr.write_line("resumed {} selected test(s) and {} binding(s) from {}"
+                      .format(len(tt._selection), len(bindings),
+                              config.option.ia_resume))
+        if missing:
+            tr.write_line("{} selected test(s) no longer exist".format(
+                len(missing)), yellow=True)
+    # warm up the most likely used indexes while waiting on input
+    tt._prefetcher = Prefetcher(tt, PytestShellEmbed.pytest_hist_file)
+    tt._prefetcher.start()
+    # embed
+    ipshell(msg, local_ns=ns)
+    tt._prefetcher.stop()
     # make final selection
-    if tt._selection:
-        items[:] = list(tt._selection.values())[:]
-    else:
-        items[:] = []
+    items = list(tt._selection.values())
+    if items and config.option.ia_reorder:
+        before = count_setups(items)
+        items = reorder_items(items)
+        tr.write_line("reordered selection, saving an estimated {} "
+                      "fixture setup(s)".format(before - count_setups(items)))
+    return items
 
 
 _root_id = '.'
+_scopes = ('session', 'package', 'module', 'class')
 Package = namedtuple('Package', 'name path node parent')
+View = namedtuple('View', 'name')
+Lazy = namedtuple('Lazy', 'name fspath')  # a package/module to be collected
+ModuleStamp = namedtuple('ModuleStamp', 'path node mtime digest')
 
 
 def gen_nodes(item, cache):
     '''generate all parent objs of this node up to the root/session
     '''
-    path = ()
     # pytest node api - lists path items in order
-    chain = item.listchain()
+    for entry in _gen_nodes(item.listchain(), (), cache):
+        yield entry
+
+
+def _rootdir(config):
+    '''Return the absolute rootdir (or cwd) of the session
+    '''
+    rootdir = getattr(config, 'rootdir', None) or os.getcwd()
+    return os.path.join(os.path.abspath(str(rootdir)), '')
+
+
+def _gen_nodes(chain, path, cache):
+    '''generate the path and tree node for each node in ``chain`` starting
+    below ``path``
+    '''
     for node in chain:
         try:
             name = node._obj.__name__
@@ -101,16 +259,26 @@ def gen_nodes(item, cache):
                 raise ae
         # packaged module
         if '.' in name and isinstance(node, _pytest.python.Module):
-            # FIXME: this should be cwd dependent!!!
-            # (i.e. don't add package objects we're below in the fs)
             prefix = tuple(name.split('.'))
             lpath = node.fspath
-            fspath = str(lpath)
-            # don't include the mod name in path
+            # the package dirs are the parent dirs of the module
+            dirs = []
+            pkgdir = lpath.dirpath()
             for level in prefix[:-1]:
-                name = '{}{}'.format(fspath[:fspath.index(level)], level)
+                dirs.insert(0, pkgdir)
+                pkgdir = pkgdir.dirpath()
+            rootdir = _rootdir(node.config)
+            # don't include the mod name in path
+            for level, pkgdir in zip(prefix[:-1], dirs):
+                dirname = str(pkgdir)
+                if rootdir.startswith(os.path.join(dirname, '')):
+                    # don't add package objects we're below in the fs
+                    continue
                 path += (level,)
-                yield path, Package(name, lpath, node, node.parent)
+                pkg = cache.get(path)
+                if not isinstance(pkg, Package) or pkg.name != dirname:
+                    pkg = Package(dirname, lpath, node, node.parent)
+                yield path, pkg
             name = prefix[-1]  # this mod's name
         # func item
         elif isinstance(node, _pytest.python.Function):
@@ -133,6 +301,103 @@ def gen_nodes(item, cache):
         yield path, node
 
 
+class TreeBuilder(object):
+    '''Generate the tree paths and nodes of items walked in collection
+    order.
+
+    Consecutive items almost always share most of their parent chain so
+    only the part of each item's chain below the closest ancestor found in
+    the previous item's chain is walked and resolved. Paths are interned
+    such that equal paths are always the same tuple.
+    '''
+    def __init__(self, cache):
+        self._cache = cache  # path -> tree node
+        self._chain = []  # parent chain of the last item
+        self._depth = {}  # id(node) -> index in the chain
+        self._ends = []  # number of entries generated by chain[:i + 1]
+        self._entries = []  # (path, node) entries of the chain
+        self._paths = {}
+
+    def _intern(self, path):
+        return self._paths.setdefault(path, path)
+
+    def _shared(self, item):
+        '''Return the index of the closest ancestor of ``item`` in the last
+        item's chain (-1 if there is none) and the parents below it
+        '''
+        new = []
+        node = item.parent
+        while node is not None:
+            index = self._depth.get(id(node))
+            if index is not None and self._chain[index] is node:
+                break
+            new.append(node)
+            node = node.parent
+        else:
+            index = -1
+        new.reverse()
+        return index, new
+
+    def _extend(self, nodes):
+        for node in nodes:
+            path = self._entries[-1][0] if self._entries else ()
+            for path, tnode in _gen_nodes([node], path, self._cache):
+                self._entries.append((self._intern(path), tnode))
+            self._depth[id(node)] = len(self._chain)
+            self._chain.append(node)
+            self._ends.append(len(self._entries))
+
+    def gen(self, item):
+        '''Return the list of (path, node) entries for ``item`` and all of
+        its parents up to the root/session
+        '''
+        index, new = self._shared(item)
+        for node in self._chain[index + 1:]:
+            del self._depth[id(node)]
+        del self._chain[index + 1:]
+        del self._ends[index + 1:]
+        del self._entries[self._ends[-1] if self._ends else 0:]
+        self._extend(new)
+        path = self._entries[-1][0] if self._entries else ()
+        return self._entries + [
+            (self._intern(path), node)
+            for path, node in _gen_nodes([item], path, self._cache)]
+
+
+def filehash(fspath, blocksize=65536):
+    '''Return a hex digest of the contents of the file at ``fspath``
+    '''
+    sha = hashlib.sha1()
+    with open(fspath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def recollect(module):
+    '''Import and collect a fresh copy of a test module node returning the
+    collected items
+    '''
+    try:
+        sys.modules.pop(module.obj.__name__, None)
+    except Exception:  # module failed to import the first time around
+        pass
+    # drop fixtures defined by the stale module (and its classes)
+    nodeid = module.nodeid
+    fm = module.session._fixturemanager
+    for fixturedefs in fm._arg2fixturedefs.values():
+        fixturedefs[:] = [
+            fd for fd in fixturedefs
+            if not (fd.baseid == nodeid or
+                    (fd.baseid or '').startswith(nodeid + '::'))]
+    cls = type(module)
+    if hasattr(cls, 'from_parent'):  # pytest >= 5.4
+        fresh = cls.from_parent(module.parent, fspath=module.fspath)
+    else:
+        fresh = cls(module.fspath, parent=module.parent)
+    return list(module.session.genitems(fresh))
+
+
 def dirinfo(obj):
     """return relevant __dir__ info for obj
     """
@@ -216,22 +481,272 @@ class TestTree(object):
         self._selection = FuncCollection()  # items must be unique
         self._path2items = OrderedDict()
         self._item2paths = {}
+        self._nodeid2item = {}
         self._path2children = {}
         self._nodes = {}
-        self._cache = {}
-        for item in funcitems:
-            for path, node in gen_nodes(item, self._nodes):
-                self._path2items.setdefault(path, []).append(item)
-                self._item2paths.setdefault(item, []).append(path)
-                if path not in self._nodes:
-                    self._nodes[path] = node
-                    # map parent path to set of children paths
-                    self._path2children.setdefault(path[:-1], set()).add(path)
+        self._cache = {}  # renderings and indexes keyed by test set
+        self._cachelock = threading.RLock()  # held while mutating the tree
+        self._cachegen = 0
+        self._modules = {}  # module fspath -> ModuleStamp
+        self._builder = TreeBuilder(self._nodes)
+        self._views = set()  # paths of virtual nodes
+        self._lazy = {}  # module path -> fspath of modules yet to collect
+        self._lazycount = {}  # path -> number of lazy modules at or below
+        self._walkorder = {}  # lazy module fspath -> index in the fs walk
+        self._collect = None  # collects lazy module files into items
+        self._profiles = {}  # nodeid -> (hotspots, allocations)
+        self._outcomes = Outcomes(self)
+        self._add_items(funcitems)
         self._root = TestSet(self, (_root_id,))
+        self._set_view('failed', [])
+        self._set_view('slowest', [])
         self.__class__.__getitem__ = self._root.__getitem__
         # pytest terminal reporter
         self._tr = termrep
 
+    def _add_items(self, items, positions=None):
+        '''Add items to the tree. If a path is found in ``positions`` items
+        are inserted into that path's item list at the given index instead
+        of being appended.
+        '''
+        positions = positions or {}
+        for item in items:
+            for path, node in self._builder.gen(item):
+                pathitems = self._path2items.setdefault(path, [])
+                if path in positions:
+                    pathitems.insert(positions[path], item)
+                    positions[path] += 1
+                else:
+                    pathitems.append(item)
+                self._item2paths.setdefault(item, []).append(path)
+                if path not in self._nodes or isinstance(
+                        self._nodes[path], Lazy):
+                    self._nodes[path] = node
+                    # map parent path to set of children paths
+                    self._path2children.setdefault(path[:-1], set()).add(path)
+                    if isinstance(node, _pytest.python.Module):
+                        self._stamp(path, node)
+            self._nodeid2item[item.nodeid] = item
+            self._outcomes.track(item)
+
+    def _stamp(self, path, module, digest=None):
+        fspath = str(module.fspath)
+        try:
+            mtime = os.stat(fspath).st_mtime
+        except OSError:
+            mtime = None
+        self._modules[fspath] = ModuleStamp(path, module, mtime, digest)
+
+    def _remove_items(self, items, below=None):
+        '''Remove items from the tree and return a map of each affected path
+        to the index its first removed item was found at. Nodes found at or
+        below the ``below`` path are dropped such that they can be replaced.
+        '''
+        items = set(items)
+        for item in items:
+            if self._nodeid2item.get(item.nodeid) is item:
+                del self._nodeid2item[item.nodeid]
+                self._outcomes.discard(item)
+        positions = {}
+        for item in items:
+            for path in self._item2paths.pop(item, ()):
+                if path in positions:
+                    continue
+                pathitems = self._path2items[path]
+                positions[path] = next(i for i, it in enumerate(pathitems)
+                                       if it in items)
+                pathitems[:] = [i for i in pathitems if i not in items]
+        for path in self._views:
+            pathitems = self._path2items[path]
+            pathitems[:] = [i for i in pathitems if i not in items]
+        for path in positions:
+            if below and path[:len(below)] == below:
+                self._nodes.pop(path, None)
+            if not self._path2items[path]:
+                # this path is now empty
+                del self._path2items[path]
+                self._nodes.pop(path, None)
+                self._path2children.pop(path, None)
+                self._path2children.get(path[:-1], set()).discard(path)
+        return positions
+
+    def _set_view(self, name, items):
+        '''Set the items of a virtual child node of the root which
+        holds an arbitrary list of items
+        '''
+        path = (_root_id, name)
+        with self._cachelock:
+            if path not in self._views:
+                self._views.add(path)
+                self._nodes[path] = View(name)
+                self._path2children.setdefault(path[:-1], set()).add(path)
+                self._invalidate()
+            self._path2items[path] = list(items)
+        return self._root._new(path=path)
+
+    def _add_lazy(self, root, modules):
+        '''Add placeholder nodes for test modules which are collected on
+        first access. ``modules`` is a sequence of lists of the tree paths
+        and fs paths of each module's packages followed by the module's own
+        (see :func:`interactive.lazy.tree_paths`).
+        '''
+        with self._cachelock:
+            self._nodes.setdefault((_root_id,), root)
+            self._path2items.setdefault((_root_id,), [])
+            for entries in modules:
+                modpath, fspath = entries[-1]
+                if modpath in self._nodes or modpath in self._lazy:
+                    continue
+                self._lazy[modpath] = fspath
+                self._walkorder.setdefault(os.path.normpath(fspath),
+                                           len(self._walkorder))
+                for path, dirpath in entries:
+                    if path not in self._nodes:
+                        self._nodes[path] = Lazy(path[-1], dirpath)
+                        self._path2children.setdefault(
+                            path[:-1], set()).add(path)
+                for i in range(1, len(modpath) + 1):
+                    self._lazycount[modpath[:i]] = self._lazycount.get(
+                        modpath[:i], 0) + 1
+            self._invalidate()
+
+    def _order(self, fspath):
+        '''Return the index of the lazy module at ``fspath`` in the fs walk
+        '''
+        return self._walkorder.get(os.path.normpath(fspath),
+                                   len(self._walkorder))
+
+    def _pending(self, path, below=True):
+        '''Return True if ``path`` is within a module yet to be collected or
+        if ``below`` is set and any such module is found below ``path``
+        '''
+        if below and self._lazycount.get(path):
+            return True
+        return any(path[:i] in self._lazy for i in range(1, len(path) + 1))
+
+    def _expand(self, path, below=True):
+        '''Collect the lazy module containing ``path`` and if ``below`` is
+        set all lazy modules below ``path`` merging their items into the tree
+        '''
+        if not self._lazy or not self._pending(path, below):
+            return
+        with self._cachelock:
+            targets = [modpath for modpath in self._lazy
+                       if path[:len(modpath)] == modpath or
+                       (below and modpath[:len(path)] == path)]
+            if not targets:
+                return
+            items = self._collect([self._lazy[modpath]
+                                   for modpath in targets])
+            modpaths = {os.path.normpath(self._lazy[modpath]): modpath
+                        for modpath in targets}
+            for modpath in targets:
+                del self._lazy[modpath]
+                for i in range(1, len(modpath) + 1):
+                    self._lazycount[modpath[:i]] -= 1
+            # insert each module's items where a full collection (which
+            # walks the fs in the same order) would have put them
+            bymodule = OrderedDict()
+            for item in items:
+                bymodule.setdefault(os.path.normpath(str(item.fspath)),
+                                    []).append(item)
+            for fspath, moditems in bymodule.items():
+                order = self._order(fspath)
+                modpath = modpaths.get(fspath, ())
+                positions = {}
+                for i in range(1, len(modpath)):
+                    pathitems = self._path2items.get(modpath[:i])
+                    if pathitems:
+                        positions[modpath[:i]] = sum(
+                            1 for item in pathitems
+                            if self._order(str(item.fspath)) < order)
+                self._add_items(moditems, positions)
+            # drop placeholders which didn't end up with any tests
+            for modpath in targets:
+                for i in range(len(modpath), 1, -1):
+                    lpath = modpath[:i]
+                    if (isinstance(self._nodes.get(lpath), Lazy) and
+                            not self._lazycount.get(lpath)):
+                        del self._nodes[lpath]
+                        self._path2children.pop(lpath, None)
+                        self._path2children.get(lpath[:-1], set()).discard(
+                            lpath)
+            self._invalidate()
+
+    def _cached(self, key, compute):
+        '''Return the cached value for ``key`` computing it with ``compute``
+        if missing. Values computed while the tree was being changed are
+        returned but not kept.
+        '''
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        gen = self._cachegen
+        value = compute()
+        with self._cachelock:
+            if gen == self._cachegen:
+                value = self._cache.setdefault(key, value)
+        return value
+
+    def _invalidate(self):
+        '''Drop all cached values
+        '''
+        with self._cachelock:
+            self._cachegen += 1
+            self._cache.clear()
+
+    def _refresh(self):
+        '''Re-collect all modules which changed on disk since they were
+        last collected and patch the tree in place.
+        Return the lists of added and removed items.
+        '''
+        with self._cachelock:
+            return self._refresh_modules()
+
+    def _refresh_modules(self):
+        added, removed = [], []
+        recollected = False
+        for fspath, stamp in list(self._modules.items()):
+            try:
+                mtime = os.stat(fspath).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == stamp.mtime:
+                continue
+            digest = filehash(fspath) if mtime else None
+            if digest and digest == stamp.digest:
+                # touched but unchanged
+                self._modules[fspath] = stamp._replace(mtime=mtime)
+                continue
+            recollected = True
+            olditems = list(self._path2items.get(stamp.path, ()))
+            del self._modules[fspath]
+            newitems = recollect(stamp.node) if mtime else []
+            positions = self._remove_items(olditems, below=stamp.path)
+            self._add_items(newitems, positions)
+            if mtime:
+                # keep tracking the module even if it no longer has tests
+                stamp = self._modules.get(fspath, stamp)
+                self._modules[fspath] = stamp._replace(mtime=mtime,
+                                                       digest=digest)
+            # patch the selection
+            new = OrderedDict((item.nodeid, item) for item in newitems)
+            for item in olditems:
+                if item.nodeid in self._selection.funcs:
+                    if item.nodeid in new:
+                        self._selection.funcs[item.nodeid] = new[item.nodeid]
+                    else:
+                        self._selection.remove(item)
+            old = set(item.nodeid for item in olditems)
+            added.extend(item for item in newitems if item.nodeid not in old)
+            removed.extend(item for item in olditems
+                           if item.nodeid not in new)
+        if recollected:
+            # items may have been reordered or re-parametrized in place
+            self._invalidate()
+        return added, removed
+
     def __str__(self):
         '''stringify current selection length
         '''
@@ -249,9 +764,12 @@ class TestTree(object):
     def __repr__(self):
         return repr(self._root)
 
-    def _tprint(self, items, tr=None):
+    def _tprint(self, items, tr=None, lines=None):
         '''extended from
         pytest.terminal.TerminalReporter._printcollecteditems
+
+        Pre-rendered ``lines`` (see ``_tlines``) for ``items`` are written
+        as is if provided.
         '''
         if not tr:
             tr = self._tr
@@ -259,18 +777,40 @@ class TestTree(object):
             tr.write('ERROR: ', red=True)
             tr.write_line("not enough items to display")
             return
+        for index, line in lines or self._tlines(items):
+            tr.write(index, green=True)
+            tr.write_line(line)
+
+    def _tlines(self, items):
+        '''Render the tree of ``items`` as a list of (index, line) pairs
+        '''
+        lines = []
+        if not items:
+            return lines
         stack = []
+        depth = {}  # id(collector) -> index in stack
         indent = ""
         ncols = int(math.ceil(math.log10(len(items))))
         for i, item in enumerate(items):
-            needed_collectors = item.listchain()[1:]  # strip root node
-            while stack:
-                if stack == needed_collectors[:len(stack)]:
+            # only walk up as far as the closest collector already printed
+            # for the previous item (the root node is never printed)
+            needed_collectors = []
+            node = item
+            while node.parent is not None:
+                shared = depth.get(id(node))
+                if shared is not None and stack[shared] is node:
                     break
-                stack.pop()
-            for col in needed_collectors[len(stack):]:
+                needed_collectors.append(node)
+                node = node.parent
+            else:
+                shared = -1
+            for col in stack[shared + 1:]:
+                del depth[id(col)]
+            del stack[shared + 1:]
+            for col in reversed(needed_collectors):
                 if col.name == "()":
                     continue
+                depth[id(col)] = len(stack)
                 stack.append(col)
                 indent = (len(stack) - 1) * "  "
                 if col == item:
@@ -278,8 +818,8 @@ class TestTree(object):
                 else:
                     index = ''
                 indent = indent[:-len(index) or None] + (ncols+1) * " "
-                tr.write("{}".format(index), green=True)
-                tr.write_line("{}{}".format(indent, col))
+                lines.append((index, "{}{}".format(indent, col)))
+        return lines
 
 
 def item2params(item):
@@ -288,6 +828,70 @@ def item2params(item):
     return tuple(map(tosymbol, cs.id.split('-'))) if cs else ()
 
 
+def argscopes(cs):
+    """Return a map of each parametrized argname of the callspec ``cs`` to
+    the name of the scope its fixture is setup at
+    """
+    arg2scope = getattr(cs, '_arg2scope', None)
+    if arg2scope is not None:  # pytest >= 7.0
+        return {argname: scope.value for argname, scope in arg2scope.items()}
+    try:
+        from _pytest.fixtures import scopes
+    except ImportError:  # pytest < 3.0
+        from _pytest.python import scopes
+    return {argname: scopes[scopenum] for argname, scopenum in
+            getattr(cs, '_arg2scopenum', {}).items()}
+
+
+def scoped_keys(item, scopenum):
+    """Return the set of parametrized fixture keys for ``item`` which
+    are setup at the given scope (an index into ``_scopes``)
+    """
+    cs = getattr(item, 'callspec', None)
+    if not cs:
+        return set()
+    scope = _scopes[scopenum]
+    scopes = argscopes(cs)
+    keys = set()
+    for argname, index in cs.indices.items():
+        if scopes.get(argname) != scope:
+            continue
+        key = (argname, index)
+        if scope == 'package':
+            key += (str(item.fspath.dirpath()),)
+        elif scope != 'session':
+            key += (str(item.fspath),)
+        if scope == 'class':
+            key += (getattr(item, 'cls', None),)
+        keys.add(key)
+    return keys
+
+
+def count_setups(items):
+    """Estimate the number of higher scoped (non-function) parametrized
+    fixture setups required to run ``items`` in order
+    """
+    count = 0
+    for scopenum in range(len(_scopes)):
+        prev = set()
+        for item in items:
+            keys = scoped_keys(item, scopenum)
+            count += len(keys - prev)
+            prev = keys
+    return count
+
+
+def reorder_items(items):
+    """Reorder items using pytest's own fixture aware sorting such that
+    higher scoped parametrized fixtures are setup as few times as possible
+    """
+    try:
+        from _pytest.fixtures import reorder_items as _reorder
+    except ImportError:  # pytest < 3.0
+        from _pytest.python import reorder_items as _reorder
+    return list(_reorder(list(items)))
+
+
 def by_name(idents):
     if idents:
         def predicate(item):
@@ -318,6 +922,11 @@ class TestSet(object):
             # (the 'or' expr is here for the 'indices = -1' case)
             indices = slice(indices, indices + 1 or None)
         self._ind = indices  # might be a slice
+        # a hashable form of the indices for use in cache keys
+        if isinstance(indices, slice):
+            self._indkey = (slice, indices.start, indices.stop, indices.step)
+        else:
+            self._indkey = (list,) + tuple(indices)
         self._params = params
         self._paramf = by_name(params)
 
@@ -325,23 +934,57 @@ class TestSet(object):
         """Pretty print the current set to console
         """
         self._tree._tr.write_line("")
-        self._tree._tprint(self._items)
+        self._tree._tprint(self._items, lines=self._cached(
+            'tlines', lambda: self._tree._tlines(self._items)))
         clsname = self.__class__.__name__
         nodename = getattr(self._node, 'name', None)
-        ident = "<{} for '{}' -> {} tests>".format(
-            str(clsname), nodename, len(self._items))
+        items = self._items
+        if self._params or self._ind != slice(None):
+            counts = self._tree._outcomes.summary(items=items)
+        else:
+            counts = self._tree._outcomes.summary(path=self._path)
+        outcomes = ''
+        if counts:
+            outcomes = " ({})".format(', '.join(
+                '{} {}'.format(count, outcome)
+                for outcome, count in sorted(counts.items())))
+        ident = "<{} for '{}' -> {} tests{}>".format(
+            str(clsname), nodename, len(items), outcomes)
         return ident
 
     def __dir__(self):
         if isinstance(self._node, FuncCollection):
-            return dir(self.params)
+            return self._paramidents + ['grid']
         return self._childkeys
 
+    def _cached(self, name, compute):
+        '''Return the tree cached value ``name`` for this set. Sets below
+        virtual nodes change as tests run and are never cached.
+        '''
+        if self._path[:2] in self._tree._views:
+            return compute()
+        key = (name, self._path, self._params, self._indkey)
+        return self._tree._cached(key, compute)
+
     @property
     def _childkeys(self):
         '''sorted list of child keys
         '''
-        return sorted([key[self._len] for key in self._iterchildren()])
+        self._tree._expand(self._path, below=False)
+        return self._cached('childkeys', lambda: sorted(
+            [key[self._len] for key in self._iterchildren()]))
+
+    @property
+    def _paramidents(self):
+        '''sorted list of callspec parameter ids of this set's items
+        '''
+        def compute():
+            idents = set()
+            for item in self._items:
+                idents.update(ident for ident in item2params(item)
+                              if ident and ident not in self._params)
+            return sorted(idents)
+        return self._cached('params', compute)
 
     @property
     def params(self):
@@ -350,25 +993,79 @@ class TestSet(object):
             def test_set(pself):
                 return self._new(params=self._params + (ident,))
             return test_set
-        ns = {}
-        for item in self._items:
-            ns.update({ident: _new(ident) for ident in item2params(item)
-                      if ident and ident not in self._params})
+        ns = {ident: _new(ident) for ident in self._paramidents}
+
+        def where(pself, **conditions):
+            '''Return the subset of tests whose callspec parameters satisfy
+            all conditions given as ``argname__op=value`` where ``op`` is
+            one of eq (the default), ne, gt, ge, lt, le or in. A callable
+            value is used as a predicate on the parameter.
+
+            Usage:
+
+            params.where(size__gt=1024, mode='a')
+            params.where(size=lambda size: size % 2)
+            '''
+            return self._where(**conditions)
+        ns['where'] = where
         return type('CallspecParameters', (), ns)()
 
+    def _where(self, **conditions):
+        if not conditions:
+            return self
+        from .paramindex import ParamIndex
+        index = self._cached('paramindex', lambda: ParamIndex(self._items))
+        base = self._basepositions()
+        return self._new(indices=[base[pos]
+                                  for pos in index.where(**conditions)])
+
+    def _basepositions(self):
+        '''positions of this set's items within the set's unindexed items
+        '''
+        if isinstance(self._ind, slice):
+            nbase = len(self._new(indices=slice(None))._items)
+            return list(range(*self._ind.indices(nbase)))
+        return list(self._ind)
+
     def _iterchildren(self):
         # if we have callspec ids in our getattr chain, filter out any
         # children who's items are not in our set by checking the
-        # intersection of our items with child items
-        for path in self._tree._path2children[self._path]:
-            if set(self._tree._path2items[path]) & set(self._items):
+        # intersection of our items with child items (virtual nodes and
+        # nodes yet to be collected are always available)
+        items = None
+        for path in self._tree._path2children.get(self._path, ()):
+            if path in self._tree._views or self._tree._lazycount.get(path):
+                yield path
+                continue
+            if items is None:
+                items = set(self._loaded_items)
+            if set(self._tree._path2items[path]) & items:
                 yield path
 
     @property
     def _items(self):
+        self._tree._expand(self._path)
+        return self._loaded_items
+
+    @property
+    def _loaded_items(self):
+        '''this set's items without collecting any lazy modules
+        '''
         # XXX might it be possible here to do something more efficient here?
-        return [item for item in filter(self._paramf,
-                self._tree._path2items[self._path])][self._ind]
+        items = [item for item in filter(self._paramf,
+                 self._tree._path2items.get(self._path, ()))]
+        if isinstance(self._ind, slice):
+            return items[self._ind]
+        # an explicit list of indices (as produced by a grid selection)
+        return [items[i] for i in self._ind]
+
+    @property
+    def grid(self):
+        '''A matrix view of this set's tests with one axis per parametrized
+        argname (see :class:`interactive.grid.ParamGrid`)
+        '''
+        from .grid import ParamGrid
+        return self._cached('grid', lambda: ParamGrid(self))
 
     def _enumitems(self):
         return self._tree._selection.enumitems(self._items)
@@ -382,7 +1079,7 @@ class TestSet(object):
             elif key in self._childkeys:  # key is a subchild name
                 return self._new(path=self._path + (key,))
             else:
-                if key in dir(self.params):
+                if key in self._paramidents:
                     return self._new(params=self._params + (key,))
                 raise KeyError(key)
         elif isinstance(key, (int, slice)):
@@ -390,6 +1087,18 @@ class TestSet(object):
 
     def _new(self, tree=None, path=None, indices=None, params=None):
         # do caching?  return self._tree._cache.setdefault(args*, ...
+        if isinstance(self._ind, list) and not isinstance(indices, list):
+            # explicit indices point into this set's unindexed items
+            if isinstance(indices, int):
+                indices = [self._ind[indices]]
+            elif isinstance(indices, slice):
+                indices = self._ind[indices]
+            elif path or params:
+                base = type(self)(tree or self._tree, path or self._path,
+                                  params=params or self._params)._items
+                positions = {item: i for i, item in enumerate(base)}
+                indices = [positions[item] for item in self._items
+                           if item in positions]
         return type(self)(
             tree or self._tree,
             path or self._path,
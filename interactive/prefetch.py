@@ -0,0 +1,128 @@
+"""
+Background precomputation of test set indexes and renderings
+"""
+import re
+import sqlite3
+import threading
+from itertools import chain
+from collections import Counter
+
+
+_ref_re = re.compile(r'\btt((?:\.\w+)+)')
+
+
+def history_refs(histfile):
+    '''Return a counter of the attribute chains (as tuples) following
+    ``tt`` in all commands stored in the shell history db ``histfile``
+    '''
+    refs = Counter()
+    try:
+        conn = sqlite3.connect(histfile)
+        try:
+            rows = conn.execute('SELECT source_raw FROM history').fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return refs
+    for source, in rows:
+        for match in _ref_re.finditer(source or ''):
+            refs[tuple(match.group(1).split('.')[1:])] += 1
+    return refs
+
+
+class Prefetcher(threading.Thread):
+    '''A background thread which fills the tree's cache with the child
+    keys, parameter ids and tree renderings of the test sets most likely to
+    be tabbed to or printed while the shell waits for input.
+
+    The top ``depth`` levels of the tree are computed first followed by
+    the nodes referenced in past shell sessions ordered by how often they
+    were used.
+    '''
+    def __init__(self, tree, histfile=None, depth=2):
+        super(Prefetcher, self).__init__(name='pytest-interactive-prefetch')
+        self.daemon = True
+        self._tree = tree
+        self._histfile = histfile
+        self.depth = depth
+        self._halt = threading.Event()
+        self.count = 0  # number of sets computed
+
+    def stop(self):
+        self._halt.set()
+
+    def _toplevels(self):
+        '''Yield the paths of the top levels of the tree breadth first
+        '''
+        level = [self._tree._root._path]
+        for _ in range(self.depth + 1):
+            for path in level:
+                yield path
+            with self._tree._cachelock:
+                level = sorted(
+                    child for path in level
+                    for child in self._tree._path2children.get(path, ())
+                    if child not in self._tree._views)
+
+    def _ranked(self):
+        '''Yield the paths of nodes used in past sessions (along with their
+        parents) most frequently used first
+        '''
+        usage = Counter()
+        for attrs, count in history_refs(self._histfile).items():
+            path = self._tree._root._path
+            for attr in attrs:
+                if path + (attr,) not in self._tree._nodes:
+                    break
+                path += (attr,)
+                usage[path] += count
+        for path, count in usage.most_common():
+            yield path
+
+    def _compute(self, path):
+        # never trigger collection of lazy modules from this thread
+        if self._tree._pending(path, below=False):
+            return
+        test_set = self._tree._root._new(path=path)
+        test_set._childkeys
+        if self._tree._pending(path):
+            return
+        test_set._paramidents
+        if test_set._items:
+            test_set._cached('tlines', lambda: self._tree._tlines(
+                test_set._items))
+
+    def run(self):
+        seen = set()
+        paths = self._toplevels()
+        if self._histfile:
+            paths = chain(paths, self._ranked())
+        for path in paths:
+            if self._halt.is_set():
+                return
+            if path in seen:
+                continue
+            seen.add(path)
+            if self._prefetch(path):
+                self.count += 1
+
+    def _prefetch(self, path, retries=3):
+        '''Compute the cached values of the set at ``path`` without holding
+        the tree's lock such that the shell never waits on this thread.
+        Values computed while the tree changes are never kept by the cache
+        and a computation which fails due to a concurrent change is retried.
+        '''
+        for _ in range(retries):
+            gen = self._tree._cachegen
+            try:
+                if path not in self._tree._nodes:
+                    return False
+                self._compute(path)
+                return True
+            except Exception:
+                # wait out any change in progress
+                with self._tree._cachelock:
+                    if gen == self._tree._cachegen:
+                        # leave it to the foreground to report
+                        return False
+        return False
@@ -0,0 +1,91 @@
+"""
+Per test profiling of in-shell runs
+"""
+import os
+import cProfile
+import pstats
+from collections import namedtuple
+import pytest
+
+try:
+    import tracemalloc
+except ImportError:  # py2 compat
+    tracemalloc = None
+
+
+Hotspot = namedtuple('Hotspot', 'func ncalls tottime cumtime')
+Allocation = namedtuple('Allocation', 'location size count')
+
+
+def funcname(key):
+    '''Render a pstats function key as ``file:line(func)``
+    '''
+    filename, line, func = key
+    if filename == '~':  # builtins
+        return func
+    return '{}:{}({})'.format(os.path.relpath(filename), line, func)
+
+
+class Profiler(object):
+    '''A pytest plugin which profiles each test run while it is registered
+    using cProfile and optionally tracemalloc.
+
+    The ``top`` hotspots of each test (by internal time) are kept by nodeid
+    and the stats of all tests are aggregated for writing to a file.
+    '''
+    def __init__(self, top=5, memory=False):
+        self.top = top
+        self.memory = memory and tracemalloc is not None
+        self.hotspots = {}  # nodeid -> [Hotspot, ...]
+        self.allocations = {}  # nodeid -> [Allocation, ...]
+        self.stats = None  # aggregated pstats.Stats
+        self._profile = None
+
+    @pytest.mark.tryfirst
+    def pytest_runtest_protocol(self, item, nextitem):
+        if self.memory:
+            tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def pytest_runtest_logreport(self, report):
+        if report.when != 'teardown' or self._profile is None:
+            return
+        profile, self._profile = self._profile, None
+        profile.disable()
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, mod.__file__)
+                for mod in (cProfile, pstats, tracemalloc)])
+            tracemalloc.stop()
+            self.allocations[report.nodeid] = [
+                Allocation(str(stat.traceback), stat.size, stat.count)
+                for stat in snapshot.statistics('lineno')[:self.top]]
+        stats = pstats.Stats(profile)
+        entries = sorted(stats.stats.items(), key=lambda e: e[1][2],
+                         reverse=True)[:self.top]
+        self.hotspots[report.nodeid] = [
+            Hotspot(funcname(key), nc, tt, ct)
+            for key, (cc, nc, tt, ct, callers) in entries]
+        if self.stats is None:
+            self.stats = stats
+        else:
+            self.stats.add(stats)
+
+    def dump(self, path):
+        '''Write the aggregated stats of all profiled tests to ``path``
+        '''
+        if self.stats:
+            self.stats.dump_stats(path)
+
+
+def write_hotspots(tr, nodeid, hotspots, allocations=()):
+    '''Write the profiling summary of a single test to the terminal
+    '''
+    tr.write_line(nodeid, bold=True)
+    for spot in hotspots:
+        tr.write_line("  {:>9.4f}s {:>9.4f}s {:>7} {}".format(
+            spot.tottime, spot.cumtime, spot.ncalls, spot.func))
+    for alloc in allocations:
+        tr.write_line("  {:>9.1f}KiB {:>7} {}".format(
+            alloc.size / 1024., alloc.count, alloc.location))
@@ -0,0 +1,297 @@
+"""
+In-process execution of test selections from within the shell
+"""
+import os
+import pickle
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from timeit import default_timer as timer
+import pytest
+from _pytest.runner import runtestprotocol
+
+
+class KeepWarm(object):
+    '''A stand-in for the "next item" handed to pytest's teardown machinery
+    which keeps all collectors in ``chain`` (and any fixtures finalized
+    along with them) set up after a run completes
+    '''
+    def __init__(self, chain):
+        self._chain = chain
+
+    def listchain(self):
+        return list(self._chain)
+
+
+# a picklable summary of a test report sent back from forked runs
+RunReport = namedtuple('RunReport', 'nodeid when passed failed skipped '
+                                    'duration')
+
+# session state pytest updates from test reports (older pytest versions
+# count failures in _testsfailed and have no shouldfail)
+_session_attrs = ('testsfailed', '_testsfailed', 'shouldfail', 'shouldstop')
+
+
+class ReportPipe(object):
+    '''A pytest plugin which pickles a summary of every test report to a
+    (pipe) file as it arrives
+    '''
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def pytest_runtest_logreport(self, report):
+        pickle.dump(RunReport(
+            report.nodeid, report.when, report.passed, report.failed,
+            report.skipped, getattr(report, 'duration', 0.)), self._wfile)
+        self._wfile.flush()
+
+
+class Runner(object):
+    '''Run test items in-process without exiting the shell.
+
+    When ``warm`` is one of 'session' or 'module' the fixtures of that scope
+    (and above) are kept alive between runs such that repeated runs skip
+    their setup cost.
+
+    When ``fork`` is True each run instead happens in a child process forked
+    from the shell process, which already has all test modules imported.
+    Every run then starts from a clean fixture state at near zero import
+    cost and a crashing test can't take down the shell. Report summaries are
+    sent back to the shell through a pipe. Since the shell runs background
+    threads (history saving, prefetching, file watching) these are stopped
+    or paused around each fork such that the child never inherits a lock
+    held by one of them (see :meth:`_paused`). A test which was set up but
+    never torn down by a crashed child is recorded as an error.
+    '''
+    def __init__(self, session, termrep, warm=None, fork=False, tree=None):
+        self.session = session
+        self.warm = warm
+        self.fork = fork
+        # the test tree whose background threads are paused when forking
+        self._tree = tree
+        # serializes runs started from the shell and background threads
+        self.lock = threading.RLock()
+        # pytest terminal reporter
+        self._tr = termrep
+
+    def _nextitem(self, item):
+        '''Return the "next item" to tear down towards after the last item
+        of a run
+        '''
+        if self.warm == 'session':
+            return KeepWarm([self.session])
+        elif self.warm == 'module':
+            module = item.getparent(pytest.Module)
+            if module:
+                return KeepWarm(module.listchain())
+        return None
+
+    def run(self, items):
+        '''Run all ``items`` in order and return the terminal reporter stats
+        for this run only
+        '''
+        with self.lock:
+            if self.fork:
+                return self._run_forked(list(items))
+            return self._run(list(items))
+
+    @contextmanager
+    def _paused(self):
+        '''Stop the prefetcher and hold the locks taken by the shell's other
+        background threads for the duration of a fork
+        '''
+        tree = self._tree
+        prefetcher = getattr(tree, '_prefetcher', None)
+        if prefetcher and prefetcher.is_alive():
+            # warming up is best effort; don't resume it later
+            prefetcher.stop()
+            prefetcher.join()
+        locks = []
+        watcher = getattr(tree, '_watcher', None)
+        if watcher and watcher.is_alive():
+            locks.append(watcher._lock)
+        history = getattr(getattr(tree, '_shell', None),
+                          'history_manager', None)
+        if history:
+            locks.extend([history.db_input_cache_lock,
+                          history.db_output_cache_lock])
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            # released in both the parent and the child
+            for lock in reversed(locks):
+                lock.release()
+
+    def _run_forked(self, items):
+        tr = self._tr
+        rfd, wfd = os.pipe()
+        with self._paused():
+            pid = os.fork()
+        if pid == 0:  # child
+            os.close(rfd)
+            status = 1
+            try:
+                pm = self.session.config.pluginmanager
+                pm.register(ReportPipe(os.fdopen(wfd, 'wb')),
+                            'interactive-reportpipe')
+                self._run(items)
+                self.teardown()
+                status = 0
+            finally:
+                # skip all interpreter and shell cleanup
+                os._exit(status)
+        os.close(wfd)
+        reports = []
+        with os.fdopen(rfd, 'rb') as rfile:
+            try:
+                while True:
+                    reports.append(pickle.load(rfile))
+            except EOFError:
+                pass
+            except KeyboardInterrupt:
+                # the child got the interrupt as well and is tearing down
+                pass
+            _, status = os.waitpid(pid, 0)
+        if status:
+            # tests set up but never torn down were running at the crash
+            running = []
+            for report in reports:
+                if report.when == 'setup':
+                    running.append(report.nodeid)
+                elif report.when == 'teardown' and report.nodeid in running:
+                    running.remove(report.nodeid)
+            tr.write_line("")
+            if os.WIFSIGNALED(status):
+                reason = "signal {}".format(os.WTERMSIG(status))
+            else:
+                reason = "exit status {}".format(os.WEXITSTATUS(status))
+            tr.write_line("run crashed with {} after {} report(s)"
+                          .format(reason, len(reports)), red=True)
+            for nodeid in running:
+                tr.write_line("    {}".format(nodeid), red=True)
+                reports.append(RunReport(nodeid, 'teardown', False, True,
+                                         False, 0.))
+        # feed results to the shell side plugins which track outcomes
+        outcomes = self.session.config.pluginmanager.getplugin(
+            'interactive-outcomes')
+        runstats = {}
+        for report in reports:
+            if outcomes:
+                outcomes.pytest_runtest_logreport(report)
+            if report.when == 'call' or not report.passed:
+                key = 'passed' if report.passed else (
+                    'failed' if report.failed else 'skipped')
+                runstats.setdefault(key, []).append(report)
+        return runstats
+
+    def _run(self, items):
+        tr = self._tr
+        session = self.session
+        # keep in-shell results out of the final session summary and exit
+        # status (including --maxfail/-x accounting)
+        stats, tr.stats = tr.stats, {}
+        state = {attr: getattr(session, attr) for attr in _session_attrs
+                 if hasattr(session, attr)}
+        try:
+            try:
+                for i, item in enumerate(items):
+                    try:
+                        nextitem = items[i + 1]
+                    except IndexError:
+                        nextitem = self._nextitem(item)
+                    item.ihook.pytest_runtest_protocol(item=item,
+                                                       nextitem=nextitem)
+            except KeyboardInterrupt:
+                tr.write_line("")
+                tr.write_line("run interrupted, tearing down...", red=True)
+                self.teardown()
+            tr.write_line("")
+            tr.summary_errors()
+            tr.summary_failures()
+        finally:
+            # an interrupted test never reports its teardown so make sure
+            # it isn't left traced for the rest of the session
+            recorder = session.config.pluginmanager.getplugin(
+                'interactive-coverage')
+            if recorder:
+                recorder.stop()
+            runstats, tr.stats = tr.stats, stats
+            for attr, value in state.items():
+                setattr(session, attr, value)
+        counts = ', '.join('{} {}'.format(len(reports), key)
+                           for key, reports in sorted(runstats.items())
+                           if key)
+        tr.write_sep('=', counts or 'no tests ran')
+        return runstats
+
+    def profile(self, items, top=5, memory=False):
+        '''Run all ``items`` profiling each test and return the
+        :class:`~interactive.profiling.Profiler` holding the results
+        '''
+        from .profiling import Profiler
+        profiler = Profiler(top=top, memory=memory)
+        pm = self.session.config.pluginmanager
+        pm.register(profiler, 'interactive-profiler')
+        try:
+            # never forked since the profiler collects in this process
+            with self.lock:
+                self._run(list(items))
+        finally:
+            pm.unregister(profiler)
+        return profiler
+
+    def bench(self, item, runs, warm=False):
+        '''Run a single ``item`` ``runs`` times and return the list of wall
+        clock times (including fixture setup and teardown) for each run.
+
+        If ``warm`` is True only function scoped fixtures are set up and
+        torn down between runs. Returns None if any run did not pass.
+        '''
+        with self.lock:
+            keep = KeepWarm(item.listchain()[:-1]) if warm else None
+            timings = []
+            try:
+                for i in range(runs):
+                    nextitem = keep or self._nextitem(item)
+                    start = timer()
+                    reports = runtestprotocol(item, log=False,
+                                              nextitem=nextitem)
+                    timings.append(timer() - start)
+                    if not all(report.passed for report in reports):
+                        return None
+            finally:
+                # tear down anything held warm just for this benchmark
+                self.session._setupstate.teardown_exact(
+                    item, self._nextitem(item))
+            return timings
+
+    def teardown(self):
+        '''Tear down all collectors and fixtures still set up
+        '''
+        self.session._setupstate.teardown_all()
+
+    def fixtures(self, scopes=('session', 'module')):
+        '''Return all set up fixture definitions of the provided scopes
+        '''
+        fm = self.session._fixturemanager
+        for name, fixturedefs in sorted(fm._arg2fixturedefs.items()):
+            for fixturedef in fixturedefs:
+                if fixturedef.scope not in scopes:
+                    continue
+                if getattr(fixturedef, 'cached_result', None) is None:
+                    continue
+                yield fixturedef
+
+    def invalidate(self, names=None):
+        '''Finalize the set up fixtures with the given names (or all if
+        ``names`` is None) and return the invalidated fixture definitions
+        '''
+        finished = []
+        for fixturedef in list(self.fixtures()):
+            if names and fixturedef.argname not in names:
+                continue
+            fixturedef.finish()
+            finished.append(fixturedef)
+        return finished
@@ -1,9 +1,44 @@
 """
 An extended shell for test selection
 """
+import os
+import getopt
+import subprocess
+from collections import Counter
 from IPython.terminal.embed import InteractiveShellEmbed
 from IPython.core.magic import (Magics, magics_class, line_magic)
-from IPython.core.history import HistoryManager
+from IPython.utils.process import arg_split
+from .history import BatchedHistoryManager
+
+
+def groupby_levels(nodeids, limit=5):
+    """Yield a ``(level, [(key, count), ...], nremaining)`` tuple for each
+    of the directory, module and function levels of ``nodeids`` listing the
+    ``limit`` largest groups
+    """
+    keyfuncs = (
+        ('directory', lambda nodeid: os.path.dirname(
+            nodeid.split('::')[0]) or '.'),
+        ('module', lambda nodeid: nodeid.split('::')[0]),
+        ('function', lambda nodeid: nodeid.split('[')[0]),
+    )
+    for level, keyfunc in keyfuncs:
+        counts = Counter(keyfunc(nodeid) for nodeid in nodeids)
+        yield level, counts.most_common(limit), max(len(counts) - limit, 0)
+
+
+def estimate_runtime(nodeids, records):
+    """Estimate the total run time of ``nodeids`` from the durations of
+    previous runs in ``records`` (see :class:`interactive.outcomes.Outcomes`).
+    Tests with no record are assumed to take the mean known duration.
+    Return the estimate and the number of tests with a known duration.
+    """
+    known = [records[nodeid][1] for nodeid in nodeids if nodeid in records]
+    if not known:
+        return None, 0
+    total = sum(known)
+    return total + (len(nodeids) - len(known)) * total / len(known), \
+        len(known)
 
 
 class PytestShellEmbed(InteractiveShellEmbed):
@@ -15,19 +50,45 @@ class PytestShellEmbed(InteractiveShellEmbed):
         .. note::
             A separate history db is allocated for this plugin separate
             from regular ip shell sessions such that only relevant
-            commands are retained.
+            commands are retained. Inputs are written in batches (see
+            :class:`interactive.history.BatchedHistoryManager`).
         """
-        self.history_manager = HistoryManager(
+        self.history_manager = BatchedHistoryManager(
             shell=self, parent=self, hist_file=self.pytest_hist_file)
         self.configurables.append(self.history_manager)
 
+    # selections larger than this are summarized on exit
+    exit_list_limit = 20
+
+    def print_summary(self, nodeids, limit=5):
+        """Print test counts for the largest groups of ``nodeids`` by
+        directory, module and function along with an estimated run time
+        """
+        for level, groups, remaining in groupby_levels(nodeids, limit):
+            print("by {}:".format(level))
+            for key, count in groups:
+                print("  {:>7} {}".format(count, key))
+            if remaining:
+                print("  ... and {} more".format(remaining))
+        outcomes = getattr(self, 'outcomes', None)
+        if outcomes is not None:
+            estimate, nknown = estimate_runtime(nodeids, outcomes.records)
+            if estimate is not None:
+                print("estimated run time: {:.2f}s (from {} of {} tests)"
+                      .format(estimate, nknown, len(nodeids)))
+        print("(use '%show' to list all tests or '%show -o FILE' to write"
+              " them to a file)")
+
     def exit(self):
         """Handle interactive exit.
         This method calls the ``ask_exit`` callback and if applicable prompts
         the user to verify the current test selection
         """
         if getattr(self, 'selection', None):
-            print(" \n".join(self.selection.keys()))
+            if len(self.selection) > self.exit_list_limit:
+                self.print_summary(list(self.selection.keys()))
+            else:
+                print(" \n".join(self.selection.keys()))
             msg = "\nYou have selected the above {} test(s) to be run."\
                   "\nWould you like to run pytest now? ([y]/n)?"\
                   .format(len(self.selection))
@@ -115,16 +176,282 @@ class SelectionMagics(Magics):
                 self.err("'{}' is not and index or slice?".format(line))
 
     @line_magic
-    def show(self, test_set):
+    def show(self, line):
         '''Show all currently selected test by pretty printing
         to the console.
 
         Usage:
 
             show:  print currently selected tests
+            show -s: print a summary of the currently selected tests
+            show -o FILE: write the nodeids of the selected tests to FILE
         '''
         items = self.selection.values()
-        if items:
+        if not items:
+            self.err()
+            return
+        opts, args = self.parse_options(line, 'so:')
+        if 'o' in opts:
+            with open(opts['o'], 'w') as f:
+                for nodeid in self.selection.keys():
+                    f.write(nodeid + '\n')
+            self.tr.write_line("wrote {} test(s) to {}".format(
+                len(items), opts['o']))
+        elif 's' in opts:
+            self.shell.print_summary(list(self.selection.keys()))
+        else:
             self.tt._tprint(items)
+
+    @line_magic
+    def rerun(self, line):
+        """Run tests in-process without exiting the shell. If no test set
+        is provided the current selection is run.
+
+        Fixtures are torn down after each run unless pytest was invoked
+        with ``--ia-warm=SCOPE`` in which case fixtures of that scope are
+        kept alive for the next run.
+
+        Usage:
+
+        rerun : run the current selection
+        rerun tt.tests : run all tests found under the 'tests' module
+        """
+        if line:
+            items = self.ns_eval(line)._items
         else:
+            items = list(self.selection.values())
+        if not items:
             self.err()
+            return
+        self.tt._runner.run(items)
+
+    @line_magic
+    def fixtures(self, line):
+        """Show or invalidate the session and module scoped fixtures which
+        are currently set up.
+
+        Usage:
+
+        fixtures : list all set up fixtures
+        fixtures -i : invalidate (tear down) all set up fixtures
+        fixtures -i dut db : invalidate only the 'dut' and 'db' fixtures
+        """
+        runner = self.tt._runner
+        opts, args = self.parse_options(line, 'i', mode='list')
+        if 'i' in opts:
+            for fixturedef in runner.invalidate(args or None):
+                self.tr.write_line("invalidated '{}'".format(
+                    fixturedef.argname))
+            return
+        fixturedefs = list(runner.fixtures())
+        if not fixturedefs:
+            self.err("No fixtures are set up")
+            return
+        for fixturedef in fixturedefs:
+            result, key = fixturedef.cached_result[:2]
+            self.tr.write("{:<8}".format(fixturedef.scope), green=True)
+            self.tr.write_line("{} (param index {}) -> {!r}".format(
+                fixturedef.argname, key, result))
+
+    @line_magic
+    def refresh(self, line):
+        """Re-collect all test modules which have changed on disk since
+        they were last collected and show which tests were added or removed.
+
+        Usage:
+
+        refresh : update the test tree with changed modules
+        """
+        with self.tt._runner.lock:
+            added, removed = self.tt._refresh()
+        if not (added or removed):
+            self.tr.write_line("no tests changed")
+            return
+        for item in removed:
+            self.tr.write("- ", red=True)
+            self.tr.write_line(item.nodeid)
+        for item in added:
+            self.tr.write("+ ", green=True)
+            self.tr.write_line(item.nodeid)
+
+    @line_magic
+    def watch(self, line):
+        """Watch the test modules of the current selection, along with any
+        loaded source modules below the rootdir, and rerun the affected
+        tests whenever they change. Watching happens in a background thread
+        so the shell remains usable and the affected tests are rerun while
+        the shell waits at the prompt.
+
+        Usage:
+
+        watch : start watching the current selection
+        watch stop : stop watching
+        """
+        from .watch import Watcher, install_inputhook
+        watcher = getattr(self.tt, '_watcher', None)
+        if line.strip() == 'stop':
+            if watcher and watcher.is_alive():
+                watcher.stop()
+                watcher.join()
+                watcher.uninstall()
+                self.shell.events.unregister('post_run_cell', watcher.update)
+                self.tr.write_line("stopped watching")
+            else:
+                self.err("Not watching")
+            return
+        if watcher and watcher.is_alive():
+            self.err("Already watching, use 'watch stop' to stop")
+            return
+        if not self.selection:
+            self.err()
+            return
+        config = self.ns_eval('config')
+        rootdir = getattr(config, 'rootdir', None) or os.getcwd()
+        self.tt._watcher = watcher = Watcher(self.tt, rootdir)
+        # refreshing and rerunning happens on the main thread
+        watcher.uninstall = install_inputhook(self.shell, watcher)
+        self.shell.events.register('post_run_cell', watcher.update)
+        watcher.start()
+        self.tr.write_line("watching {} file(s) for changes...".format(
+            len(watcher._mtimes)))
+
+    @line_magic
+    def affected(self, line):
+        """Select the tests impacted by changes since a git revision into
+        the virtual ``tt.affected`` node. Impact is determined using the
+        per test line coverage recorded by previous sessions run with
+        ``--ia-record-coverage``.
+
+        Usage:
+
+        affected : tests impacted by uncommitted changes
+        affected master : tests impacted by changes since 'master'
+        """
+        from .impact import load_map, changed_lines, affected
+        rev = line.strip() or 'HEAD'
+        covmap = load_map(self.ns_eval('config'))
+        if not covmap.tests:
+            self.err("No coverage recorded, run with --ia-record-coverage")
+            return
+        try:
+            changes = changed_lines(rev)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.err("Failed to diff against '{}': {}".format(rev, e))
+            return
+        items = affected(self.tt._path2items[self.tt._root._path], covmap,
+                         changes)
+        self.tt._set_view('affected', items)
+        self.tr.write_line("{} test(s) affected by changes since '{}', "
+                           "see tt.affected".format(len(items), rev))
+
+    @line_magic
+    def profile(self, line):
+        """Run a test set in-process profiling each test with cProfile
+        and show the top hotspots (by internal time) of every test.
+        Aggregated stats for all tests are written to a file for later
+        inspection with pstats or snakeviz.
+
+        Options:
+
+        -m : also trace memory allocations using tracemalloc
+        -n N : show the top N hotspots per test (default 5)
+        -o FILE : write the aggregated stats to FILE
+        -s : show the hotspots recorded by previous runs without running
+
+        Usage:
+
+        profile tt.tests.test_setA : profile all tests under 'test_setA'
+        profile -m -n 10 tt.test_setA[3] : profile with memory tracing
+        profile -s tt.test_setA : show previously recorded hotspots
+        """
+        from .plugin import confpath
+        from .profiling import write_hotspots
+        opts, expr = self.parse_options(line, 'msn:o:')
+        items = self.ns_eval(expr)._items if expr else list(
+            self.selection.values())
+        if not items:
+            self.err()
+            return
+        profiles = self.tt._profiles
+        if 's' not in opts:
+            profiler = self.tt._runner.profile(
+                items, top=int(opts.get('n', 5)), memory='m' in opts)
+            for nodeid, hotspots in profiler.hotspots.items():
+                profiles[nodeid] = (hotspots,
+                                    profiler.allocations.get(nodeid, []))
+            path = opts.get('o', confpath('last.prof'))
+            profiler.dump(path)
+        for item in items:
+            if item.nodeid in profiles:
+                write_hotspots(self.tr, item.nodeid, *profiles[item.nodeid])
+        if 's' not in opts and profiler.stats is not None:
+            self.tr.write_line("aggregated stats written to {}".format(path))
+
+    @line_magic
+    def bench(self, line):
+        """Benchmark a single test by running it (including its fixtures)
+        many times in-process and show the min, median, 95th percentile and
+        standard deviation of its run times. If a baseline was saved for
+        the test the results are compared against it.
+
+        Options:
+
+        -n N : number of runs (default 20)
+        -w : hold all but function scoped fixtures warm between runs
+        -s : save the results as the new baseline for this test
+
+        Usage:
+
+        bench tt.test_setA.test_modes[1] : benchmark the 2nd 'test_modes'
+        bench tt.test_setA[3] -n 50 -w -s : 50 warm runs saved as baseline
+        """
+        from .plugin import rootpath
+        from .bench import Baselines, summarize, write_summary
+        # options may follow the test expression
+        try:
+            optlist, args = getopt.gnu_getopt(
+                arg_split(line, posix=False), 'wsn:')
+            opts = dict(optlist)
+            runs = int(opts.get('-n', 20))
+        except (getopt.GetoptError, ValueError) as e:
+            self.err(str(e))
+            return
+        if runs < 1:
+            self.err("The number of runs must be at least 1")
+            return
+        expr = ' '.join(args)
+        items = self.ns_eval(expr)._items if expr else []
+        if len(items) != 1:
+            self.err("Select exactly one test to benchmark")
+            return
+        item = items[0]
+        timings = self.tt._runner.bench(item, runs, warm='-w' in opts)
+        if timings is None:
+            self.err("'{}' did not pass".format(item.nodeid))
+            return
+        baselines = Baselines(rootpath(self.ns_eval('config'), 'bench'))
+        summary = summarize(timings)
+        write_summary(self.tr, item.nodeid, summary,
+                      baselines.get(item.nodeid))
+        if '-s' in opts:
+            baselines.set(item.nodeid, summary)
+            self.tr.write_line("saved as baseline")
+
+    @line_magic
+    def checkpoint(self, line):
+        """Save the current selection along with all names in the shell
+        namespace bound to test sets such that they can be restored in a
+        later session using ``--ia-resume FILE``. Tests are remapped by
+        nodeid on restore.
+
+        Usage:
+
+        checkpoint : save to the default checkpoint file for this rootdir
+        checkpoint FILE : save to FILE
+        """
+        from .plugin import rootpath
+        from .checkpoint import save
+        path = line.strip() or rootpath(self.ns_eval('config'), 'checkpoint')
+        save(path, self.tt, self.shell.user_ns)
+        self.tr.write_line("saved {} selected test(s) to {}".format(
+            len(self.selection), path))
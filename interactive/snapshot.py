@@ -0,0 +1,217 @@
+"""
+Merkle snapshots of the test tree and diffs between collections
+"""
+import json
+import hashlib
+from collections import OrderedDict
+import pytest
+
+
+def _sha(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _snapshot(children, nodeid, path):
+    kids = children(path)
+    if not kids:
+        return {'d': _sha(nodeid(path)), 'id': nodeid(path)}
+    subtrees = {}
+    sha = hashlib.sha1()
+    for child in sorted(kids):
+        sub = subtrees[child[-1]] = _snapshot(children, nodeid, child)
+        sha.update('{}\0{}\n'.format(child[-1], sub['d']).encode('utf-8'))
+    return {'d': sha.hexdigest(), 'c': subtrees}
+
+
+def snapshot(tree, path=None):
+    '''Return a snapshot of the subtree of ``tree`` at ``path`` (the root by
+    default) as nested dicts. Each node holds a digest of its children's
+    keys and digests (``d``) and its children (``c``) while each test
+    holds a digest of its nodeid and the nodeid itself (``id``). Virtual
+    nodes are left out.
+    '''
+    if path is None:
+        path = tree._root._path
+    return _snapshot(
+        lambda path: [child for child in tree._path2children.get(path, ())
+                      if child not in tree._views],
+        lambda path: tree._nodes[path].nodeid, path)
+
+
+def snapshot_items(items):
+    '''Return a snapshot (see :func:`snapshot`) of the tree ``items`` would
+    be laid out in without building a :class:`~interactive.plugin.TestTree`
+    '''
+    from .plugin import TreeBuilder, _root_id
+    if not items:
+        return {'d': _sha(''), 'c': {}}
+    nodes, path2children, nodeids = {}, {}, {}
+    builder = TreeBuilder(nodes)
+    for item in items:
+        for path, node in builder.gen(item):
+            nodes.setdefault(path, node)
+            path2children.setdefault(path[:-1], set()).add(path)
+        nodeids[path] = item.nodeid
+    return _snapshot(lambda path: path2children.get(path, ()),
+                     nodeids.__getitem__, (_root_id,))
+
+
+def save(path, snap):
+    with open(path, 'w') as f:
+        json.dump(snap, f, separators=(',', ':'))
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def leaves(snap):
+    '''Return the nodeids of all tests in a snapshot
+    '''
+    if 'id' in snap:
+        return [snap['id']]
+    nodeids = []
+    for key in sorted(snap['c']):
+        nodeids.extend(leaves(snap['c'][key]))
+    return nodeids
+
+
+def _split(nodeid):
+    '''Split a nodeid into its parent's nodeid, function name and callspec
+    id suffix (None if not parametrized)
+    '''
+    parent, _, name = nodeid.rpartition('::')
+    funcname = name.split('[')[0]
+    return parent, funcname, name[len(funcname):] or None
+
+
+def pair_renames(added, removed):
+    '''Pair up added and removed tests of the same parent node as renames.
+    A parametrized function counts as renamed if another one of the same
+    parent had exactly the same callspec ids. Otherwise a single test added
+    to and a single test removed from a parent are paired. Return the
+    remaining added and removed nodeids along with the list of (old, new)
+    renamed pairs.
+    '''
+    def groups(nodeids):
+        funcs = OrderedDict()  # (parent, funcname) -> {suffix: nodeid}
+        for nodeid in nodeids:
+            parent, funcname, suffix = _split(nodeid)
+            funcs.setdefault((parent, funcname), {})[suffix] = nodeid
+        return funcs
+
+    oldfuncs = groups(removed)
+    renamed, paired = [], set()
+    for (parent, funcname), new in groups(added).items():
+        if None in new:
+            continue
+        for key, old in oldfuncs.items():
+            if key[0] == parent and None not in old and \
+                    set(old) == set(new) and old[min(old)] not in paired:
+                for suffix in sorted(new):
+                    renamed.append((old[suffix], new[suffix]))
+                    paired.add(old[suffix])
+                    paired.add(new[suffix])
+                break
+    # a single test left added to and removed from the same parent
+    byparent = OrderedDict()
+    for i, nodeids in enumerate((added, removed)):
+        for nodeid in nodeids:
+            if nodeid not in paired:
+                byparent.setdefault(_split(nodeid)[0], ([], []))[i].append(
+                    nodeid)
+    for parent, (new, old) in byparent.items():
+        if len(new) == len(old) == 1:
+            renamed.append((old[0], new[0]))
+            paired.update((old[0], new[0]))
+    return ([nodeid for nodeid in added if nodeid not in paired],
+            [nodeid for nodeid in removed if nodeid not in paired], renamed)
+
+
+def diff(old, new, path=None, changes=None):
+    '''Compare two snapshots and return a list of ``(path, added, removed,
+    renamed)`` tuples for each node with changed children. Subtrees with
+    equal digests are skipped such that the work done is proportional to
+    the size of the change rather than the size of the suite.
+    '''
+    if path is None:
+        from .plugin import _root_id
+        path = (_root_id,)
+    if changes is None:
+        changes = []
+    if old['d'] == new['d']:
+        return changes
+    if 'id' in old or 'id' in new:
+        # a test replaced in place by another test or a subtree
+        added, removed, renamed = pair_renames(leaves(new), leaves(old))
+        if len(added) == len(removed) == 1:
+            renamed.append((removed.pop(), added.pop()))
+        changes.append((path[:-1], added, removed, renamed))
+        return changes
+    oldc, newc = old['c'], new['c']
+    added, removed = [], []
+    for key in sorted(set(oldc) | set(newc)):
+        if key not in oldc:
+            added.extend(leaves(newc[key]))
+        elif key not in newc:
+            removed.extend(leaves(oldc[key]))
+        else:
+            diff(oldc[key], newc[key], path + (key,), changes)
+    if added or removed:
+        changes.append((path,) + pair_renames(added, removed))
+    return changes
+
+
+class SnapshotDiff(object):
+    '''A pytest plugin which writes a snapshot of the collected tree to
+    ``snappath`` and/or compares it against the snapshot at ``oldpath``.
+
+    When comparing, all tests are deselected, the differences are
+    reported in the terminal summary and the session's exit status is set
+    to 1 if any were found.
+    '''
+    def __init__(self, snappath=None, oldpath=None):
+        self.snappath = snappath
+        self.oldpath = oldpath
+        self.changes = None
+
+    # diff the whole collection before anything else deselects from it
+    @pytest.mark.tryfirst
+    def pytest_collection_modifyitems(self, session, config, items):
+        if getattr(session, '_ia_collecting', False):
+            return  # modules collected on demand from the shell
+        snap = snapshot_items(items)
+        if self.snappath:
+            save(self.snappath, snap)
+        if self.oldpath:
+            self.changes = diff(load(self.oldpath), snap)
+            config.hook.pytest_deselected(items=list(items))
+            items[:] = []
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.changes is None:
+            return
+        tr = terminalreporter
+        tr.write_sep('=', 'collection diff against {}'.format(self.oldpath))
+        counts = [0, 0, 0]
+        for path, added, removed, renamed in self.changes:
+            # as the node would be referred to from the shell
+            tr.write_line('.'.join(('tt',) + tuple(path[1:])), bold=True)
+            for nodeid in added:
+                tr.write_line('  + {}'.format(nodeid), green=True)
+            for nodeid in removed:
+                tr.write_line('  - {}'.format(nodeid), red=True)
+            for oldid, newid in renamed:
+                tr.write_line('  ~ {} -> {}'.format(oldid, newid),
+                              yellow=True)
+            for i, nodeids in enumerate((added, removed, renamed)):
+                counts[i] += len(nodeids)
+        tr.write_line('{} added, {} removed, {} renamed'.format(*counts))
+
+    def pytest_sessionfinish(self, session):
+        if self.changes is None or session.exitstatus not in (0, 5):
+            return
+        # 5 is 'no tests collected' which is expected since all were
+        # deselected
+        session.exitstatus = 1 if self.changes else 0
@@ -0,0 +1,266 @@
+"""
+Watch the files behind a test selection and rerun it on changes
+"""
+import os
+import sys
+import time
+import signal
+import threading
+import importlib
+from contextlib import contextmanager
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+@contextmanager
+def interruptible():
+    '''Have ctrl-c raise KeyboardInterrupt in the enclosed block even
+    while the shell's prompt has its own SIGINT handling set up (which
+    also isn't notified of signals received within the block)
+    '''
+    handler = signal.signal(signal.SIGINT, signal.default_int_handler)
+    wakeup_fd = signal.set_wakeup_fd(-1)
+    try:
+        yield
+    finally:
+        signal.set_wakeup_fd(wakeup_fd)
+        if handler is not None:
+            signal.signal(signal.SIGINT, handler)
+
+
+def source_files(rootdir):
+    '''Return a map of the source file of each loaded python module found
+    below ``rootdir`` to the module
+    '''
+    rootdir = os.path.join(os.path.abspath(str(rootdir)), '')
+    files = {}
+    for module in list(sys.modules.values()):
+        fspath = getattr(module, '__file__', None)
+        if not fspath:
+            continue
+        fspath = os.path.abspath(fspath)
+        if fspath.endswith(('.pyc', '.pyo')):
+            fspath = fspath[:-1]
+        if fspath.startswith(rootdir) and os.path.isfile(fspath):
+            files[fspath] = module
+    return files
+
+
+class Watcher(threading.Thread):
+    '''A background thread which watches the test modules of the current
+    selection along with any loaded source modules below ``rootdir``.
+
+    Changes are only detected in the thread. Refreshing the tree, reloading
+    changed source modules and rerunning the affected selected tests is
+    left to :meth:`rerun` which is called from the shell's main thread
+    while it waits at the prompt (see :func:`install_inputhook`), such that
+    tests run where they can be interrupted and never race with changes to
+    the selection. inotify is
+    used if the ``inotify_simple`` package is installed otherwise files are
+    polled every ``interval`` seconds. Bursts of changes are debounced
+    until no further change is seen for ``debounce`` seconds.
+    '''
+    def __init__(self, tree, rootdir, interval=0.5, debounce=0.25):
+        super(Watcher, self).__init__(name='pytest-interactive-watch')
+        self.daemon = True
+        self._tree = tree
+        self._rootdir = rootdir
+        self.interval = interval
+        self.debounce = debounce
+        self._halt = threading.Event()
+        self._lock = threading.Lock()  # guards the two attrs below
+        self._changed = set()  # files changed since the last rerun
+        self._files = None  # files to watch from the next scan on
+        self._selected = None  # selected nodeids when last updated
+        self._mtimes = {}
+        self._sources = {}
+        self._inotify = None
+        self._wds = {}
+        self.update()
+        self._scan()
+
+    def _testfiles(self):
+        '''Return the set of test module files for the current selection
+        '''
+        return set(os.path.abspath(str(item.fspath))
+                   for item in self._tree._selection.values())
+
+    def update(self, *info):
+        '''Rebuild the set of watched files if the selection was modified.
+        Must be called from the main thread (i.e. after each input).
+        '''
+        selected = list(self._tree._selection.keys())
+        if selected == self._selected:
+            return
+        self._selected = selected
+        # test modules are re-collected by the tree rather than reloaded
+        self._sources = {
+            fspath: module
+            for fspath, module in source_files(self._rootdir).items()
+            if fspath not in self._tree._modules and
+            os.path.basename(fspath) != 'conftest.py'}
+        with self._lock:
+            self._files = self._testfiles() | set(self._sources)
+
+    def _scan(self):
+        '''Start watching the files handed over by :meth:`update`
+        recording their mtimes
+        '''
+        with self._lock:
+            files, self._files = self._files, None
+        if files is None:
+            return
+        self._mtimes = {fspath: self._mtime(fspath) for fspath in files}
+        if inotify_simple:
+            if self._inotify:
+                self._inotify.close()
+            self._inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+            dirs = set(os.path.dirname(fspath) for fspath in files)
+            self._wds = {self._inotify.add_watch(d, mask): d for d in dirs}
+
+    @staticmethod
+    def _mtime(fspath):
+        try:
+            return os.stat(fspath).st_mtime
+        except OSError:
+            return None
+
+    def _poll(self):
+        '''Return the set of watched files which changed since last polled
+        '''
+        changed = set()
+        for fspath, mtime in self._mtimes.items():
+            current = self._mtime(fspath)
+            if current != mtime:
+                self._mtimes[fspath] = current
+                changed.add(fspath)
+        return changed
+
+    def _wait(self, timeout):
+        '''Block for up to ``timeout`` seconds and return the set of watched
+        files which changed
+        '''
+        if not self._inotify:
+            self._halt.wait(timeout)
+            return self._poll()
+        changed = set()
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            fspath = os.path.join(self._wds.get(event.wd, ''), event.name)
+            if fspath in self._mtimes:
+                self._mtimes[fspath] = self._mtime(fspath)
+                changed.add(fspath)
+        return changed
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            self._scan()
+            changed = self._wait(self.interval)
+            if not changed:
+                continue
+            # debounce until the burst of writes settles
+            while not self._halt.is_set():
+                more = self._wait(self.debounce)
+                if not more:
+                    break
+                changed |= more
+            if self._halt.is_set():
+                break
+            with self._lock:
+                self._changed |= changed
+        if self._inotify:
+            self._inotify.close()
+
+    def pending(self):
+        '''Return True if changes were detected since the last rerun
+        '''
+        with self._lock:
+            return bool(self._changed)
+
+    def rerun(self):
+        '''Rerun the tests affected by any changes detected since the last
+        call. Must be called from the main thread.
+        '''
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return
+        try:
+            with interruptible(), self._tree._runner.lock:
+                self._rerun(changed)
+        except Exception as e:
+            self._tree._tr.write_line(
+                "watch: rerun failed with '{!r}'".format(e), red=True)
+        # modules may have been (re)imported so rescan
+        self._selected = None
+        self.update()
+
+    def _rerun(self, changed):
+        '''Reload changed sources, refresh the tree and rerun all affected
+        tests in the current selection
+        '''
+        tt = self._tree
+        tr = tt._tr
+        tr.write_line("")
+        tr.write_line("watch: rerunning after changes in {}".format(
+            ', '.join(sorted(os.path.relpath(p) for p in changed))))
+        testfiles = self._testfiles()
+        sources = [self._sources[fspath] for fspath in changed
+                   if fspath in self._sources and fspath not in testfiles]
+        for module in sources:
+            try:
+                importlib.reload(module)
+            except Exception as e:
+                tr.write_line("watch: failed to reload '{}' with '{!r}'"
+                              .format(module.__name__, e), red=True)
+        tt._refresh()
+        if sources:
+            # any test might depend on a changed source module
+            items = list(tt._selection.values())
+        else:
+            items = [item for item in tt._selection.values()
+                     if os.path.abspath(str(item.fspath)) in changed]
+        if items:
+            tt._runner.run(items)
+        else:
+            tr.write_line("watch: no selected tests affected")
+
+
+def install_inputhook(shell, watcher, interval=0.1):
+    '''Have ``shell`` call :meth:`Watcher.rerun` whenever changes are
+    pending while it waits for input at the prompt and return a function
+    which uninstalls the hook again. Any gui event loop integration enabled
+    in the shell is replaced.
+    '''
+    try:
+        from IPython.terminal.pt_inputhooks import register
+    except ImportError:  # IPython < 5 (readline)
+        from IPython.lib.inputhook import inputhook_manager
+
+        def readline_hook():
+            watcher.rerun()
+            return 0
+        inputhook_manager.set_inputhook(readline_hook)
+        return inputhook_manager.clear_inputhook
+    try:
+        from prompt_toolkit.application import run_in_terminal
+    except ImportError:  # prompt_toolkit < 2.0
+        run_in_terminal = shell.pt_cli.run_in_terminal
+
+    def inputhook(context):
+        while not context.input_is_ready():
+            if watcher.pending():
+                # clear the prompt and leave raw mode while tests run
+                run_in_terminal(watcher.rerun)
+                return
+            time.sleep(interval)
+    register('pytest-interactive-watch', inputhook)
+    shell.enable_gui('pytest-interactive-watch')
+    return shell.enable_gui
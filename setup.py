@@ -14,6 +14,7 @@ setup(
      entry_points = {'pytest11': ['interactive = interactive.plugin'],},
      zip_safe=False,
      install_requires = ['pytest>=2.4.2', 'ipython'],
+     extras_require = {'inotify': ['inotify_simple'], 'grid': ['numpy']},
      classifiers=[
      'Development Status :: 3 - Alpha',
      'Intended Audience :: Developers',